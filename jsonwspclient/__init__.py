@@ -7,10 +7,14 @@ __init__ :mod:`jsonwspclient.__init__`
 """
 from .jsonwspclient import __version__
 from .jsonwspclient import JsonWspClient
+from .jsonwspasync import AsyncJsonWspClient, AsyncJsonWspResponse
+from .jsonwspcache import DescriptionCache, ResponseCache
 from .jsonwspresponse import JsonWspResponse
 from .jsonwspmultipart import JsonWspAttachment
+from .jsonwsputils import Progress
 from .jsonwspexceptions import (
     ClientFault,
+    DeadlineExceeded,
     IncompatibleFault,
     JsonWspException,
     JsonWspFault,
@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+"""
+==============================================
+Jsonwspasync :mod:`jsonwspclient.jsonwspasync`
+==============================================
+
+Asyncio counterpart of :any:`JsonWspClient` based on
+`aiohttp <https://docs.aiohttp.org/>`_ (``pip install jsonwspclient[async]``).
+"""
+import asyncio
+import logging
+import platform
+import ssl
+import time
+
+from requests.compat import urljoin, urlparse
+from requests.structures import CaseInsensitiveDict
+
+from . import jsonwspexceptions as excs
+from . import jsonwsputils as utils
+from .jsonwspcache import get_description_cache
+from .jsonwspclient import __version__
+from .jsonwspmultipart import (
+    BufferedMultiPartReader, MultiPartReader, MultiPartWriter)
+from .jsonwspresponse import JsonWspResponse
+from .jsonwspservice import JsonWspService
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+log = logging.getLogger('jsonwspclient')
+
+
+class AsyncStreamWithCallBack:
+    """Async version of :class:`FileWithCallBack` for aiohttp responses."""
+
+    def __init__(self, response, callback, size=0, progress=None):
+        self._response = response
+        self._read_bytes = 0
+        self._length = size
+        self._callback = callback
+        self._listening = utils.listening(callback)
+        self._progress = (progress or utils.Progress()).meter(size)
+        self._callback(
+            'file.init', fobj=self._response, value=0, length=self._length)
+
+    async def read(self, size):
+        """read."""
+        if self._read_bytes == 0:
+            self._callback('file.start', fobj=self._response,
+                           value=self._read_bytes, length=self._length)
+        data = await self._response.content.read(size)
+        self._read_bytes += len(data)
+        if (self._listening('file.read') and
+                self._progress.due(self._read_bytes)):
+            self._callback('file.read', fobj=self._response,
+                           value=self._read_bytes, length=self._length,
+                           **self._progress.stats(self._read_bytes))
+        if not data:
+            self._callback('file.end', fobj=self._response,
+                           value=self._read_bytes, length=self._length,
+                           **self._progress.stats(self._read_bytes))
+        return data
+
+    def close(self):
+        """Close."""
+        self._callback('file.close', fobj=self._response,
+                       value=self._read_bytes, length=self._length)
+        self._response.release()
+        self._callback('file.closed', fobj=self._response,
+                       value=self._read_bytes, length=self._length)
+
+
+class AsyncMultiPartReader(MultiPartReader):
+    """Reader for async streams."""
+
+    async def read_chunk(self, size=None):
+        """read_chunk"""
+        if self._end_of_stream:
+            return None
+        self._check_deadline()
+        size = size or self._chunk_size
+        chunk_size = min(size, self._length - self._read_bytes)
+        chunk = await self._content.read(chunk_size)
+        self._read_bytes += len(chunk)
+        if not chunk:
+            self._end_of_stream = True
+            self._content.close()
+        return chunk
+
+    async def read_all(self, chunk_size=None):
+        """read_all"""
+        while not self._end_of_stream:
+            await self.read(chunk_size)
+        return self
+
+    async def read(self, chunk_size=None):
+        """read"""
+        if self._read_bytes == 0:
+            self._callback(
+                "multipartreader.start",
+                uuid=self.uuid,
+                value=self._read_bytes,
+                length=self._length,
+                attach=self.get_current_attach(),
+            )
+        chunk_size = chunk_size or self._chunk_size
+        try:
+            self.feed(await self.read_chunk(chunk_size))
+        except BaseException:
+            self.close()
+            raise
+
+    async def iterator(self, chunk_size=None):
+        """Async iterator (closed before the end closes the reader)."""
+        last_closed = self._last_closed
+        try:
+            while not self._end_of_stream:
+                await self.read(chunk_size)
+                if self._info_done == 1:
+                    yield self.info
+                    self._info_done = 2
+                # a single chunk can close more than one attachment.
+                while last_closed < self._last_closed:
+                    last_closed += 1
+                    if self.is_accepted(self.attachs[last_closed]):
+                        yield self.attachs[last_closed]
+        finally:
+            self.close()
+
+
+class AsyncBufferedMultiPartReader(AsyncMultiPartReader, BufferedMultiPartReader):
+    """Incremental reader for async streams."""
+
+
+ASYNC_READERS = {
+    'regex': AsyncMultiPartReader,
+    'buffer': AsyncBufferedMultiPartReader,
+}
+"""(dict): async multipart reader engines by name."""
+
+
+class AsyncJsonWspResponse(JsonWspResponse):
+    """Async JsonWspResponse (wrapper for `aiohttp ClientResponse
+    <https://docs.aiohttp.org/en/stable/client_reference.html#response-object>`_).
+
+    Multipart responses are consumed with ``async for`` or with the
+    awaitable :meth:`read_all` and :meth:`save_all`.
+    """
+
+    _areader = None
+
+    def _process(self):
+        """Processing is deferred to :meth:`_aprocess`."""
+
+    async def _aprocess(self):
+        """_aprocess."""
+        if self._boundary:
+            self._multipart = self._new_reader(
+                AsyncStreamWithCallBack(
+                    self._response, self._trigger, size=self.length,
+                    progress=self._reader_options.get('progress')),
+                ASYNC_READERS)
+            self._areader = self._multipart.iterator()
+            self.response_dict = await self._areader.__anext__()
+        else:
+            try:
+                self.response_dict = await self._response.json(
+                    content_type=None) or {}
+            except ValueError as error:
+                log.debug('error %s', error)
+                self.response_dict = {}
+        self._check_fault()
+        self._get_attchments_id()
+        return self
+
+    @property
+    def _reader(self):
+        if not self.is_multipart:
+            raise TypeError("Is not a multipart response")
+        elif self._areader is None:
+            raise IOError("Reader is None")
+        return self._areader
+
+    async def read_all(self, chunk_size=None, sink=None, accept=None):
+        """Read all the data and return a Dictionary containig the Attachments.
+
+        Args:
+            chunk_size (int): bytes to read each time.
+            sink (function, optional): sink factory for the attachments not
+                yet read, it receives the attachment id and headers and
+                returns a writable for the attachment data.
+            accept (set, function, optional): content ids of the attachments
+                to keep or a predicate over their headers.
+
+        Returns:
+            dict: Dictionary with all attachments.
+        """
+        if sink is not None:
+            self._multipart.sink = sink
+        if accept is not None:
+            self._multipart.accept = accept
+        await self._multipart.read_all(chunk_size)
+        return self._multipart.accepted()
+
+    async def save_all(self, path, name='name', overwrite=True, direct=False,
+                       accept=None):
+        """Save all the attachments ad once.
+
+        Args:
+            path (str): Path where to save.
+            name (str, optional): key with which the file name is specified in the
+                dictionary (default ``name``).
+            overwrite (bool, optional): overwrite the file if exists (defautl True).
+            direct (bool, optional): write the attachments not yet read
+                directly to their destination, through a ``.partial`` file
+                renamed once complete (default False).
+            accept (set, function, optional): content ids of the attachments
+                to save or a predicate over their headers.
+        """
+        self._prepare_save(path, name, overwrite, direct, accept)
+        async for attach in self._reader:
+            if not attach:
+                break
+            self._save_attach(attach, path, name, overwrite)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """If AsyncJsonWspResponse is multipart returns the next attachment.
+
+        Returns:
+            JsonWspAttachment: the attachment object.
+        """
+        return await self._reader.__anext__()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._multipart is not None:
+            self._multipart.close()
+        self._response.release()
+
+
+class AsyncJsonWspService(JsonWspService):
+    """Async Service."""
+
+    def __init__(self, client, service_name):
+        # pylint: disable=super-init-not-called
+        # the description is loaded by the client with await.
+        self.name = service_name
+        self._client = client
+        self._description_loaded = False
+        self._methods = {}
+        self._plans = {}
+        self._post = client.post
+        self._post_mp = client.post_mp
+        self._trigger = client.trigger
+
+    async def _load_description(self):
+        """Loads description for this service."""
+        entry = self._cached_description()
+        if entry and self._client.description_cache.is_fresh(entry):
+            self._set_description(entry['description'])
+            return self
+        response = await self._post(
+            '/{}/jsonwsp/description'.format(self.name), method='GET',
+            headers=self._client.description_cache.validators(entry)
+            if entry else None)
+        self._set_description(self._description_from(response, entry))
+        return self
+
+    async def _call_method(self, method_name, **kwargs):
+        """Call method."""
+        data, attachment_map, raise_for_fault, post_options = \
+            self._prepare_call(method_name, kwargs)
+        self._trigger(
+            'service.call_method.before', service=self, method=method_name,
+            attachment_map=attachment_map, **kwargs)
+        try:
+            if attachment_map['files']:
+                try:
+                    response = await self._post_mp(
+                        self.url, data, attachment_map['files'],
+                        **post_options)
+                finally:
+                    utils.close_opened(attachment_map)
+            else:
+                response = await self._post(self.url, data, **post_options)
+            response = self._process_response(
+                response, method_name, raise_for_fault, **kwargs)
+        except excs.JsonWspFault as error:
+            log.exception(error)
+            raise
+        except aiohttp.ClientError as error:
+            log.exception(error)
+            raise
+        else:
+            self._trigger(
+                'service.call_method.after', service=self, method=method_name,
+                attachment_map=attachment_map, **kwargs)
+        return response
+
+
+class AsyncJsonWspClient:
+    """Async JsonWsp Client.
+
+    Same as :any:`JsonWspClient` but the services methods, :meth:`post` and
+    :meth:`post_mp` are coroutines. The services are loaded with :meth:`load`
+    or entering the ``async with`` statement.
+
+    Args:
+        url (str): base url where to retrieve all services.
+        services ([str]): list of Service names to retrieve.
+        headers (dict): Headers to add or repalce.
+        events ([(str, function)]): list of tuples contaning the event name
+            and the relative function.
+        processors ([function]): list of functions that can process
+            and/or modify responses before they are returned.
+        params_mapping (dict): Dictionary with mapping for client attributes or
+            methods to service command parmaters.
+        raise_for_fault (bool): Automatically raise Exceptions on JSON-WSP response faults.
+        auth (tuple, aiohttp.BasicAuth): **username** and **password** tuple
+            or `aiohttp.BasicAuth` instance.
+        proxies (dict): Dictionary mapping protocol to the URL of the proxy.
+        verify (bool, str): Either a boolean, in which case it controls whether we
+            verify the server's TLS certificate, or a string, in which case
+            it must be a path to a CA bundle to use.
+        response_class (AsyncJsonWspResponse subclass): Custom Response class
+            wich subclass AsyncJsonWspResponse (default AsyncJsonWspResponse).
+        description_cache (DescriptionCache, str): cache for the services
+            descriptions (or the path of the cache folder).
+        timeout (float, tuple): Default timeout for the requests, seconds or
+            a (connect, read) tuple (default aiohttp timeout).
+        method_timeouts (dict): Timeouts for specific methods by method name.
+        reader_engine (str): Multipart reader engine, ``'buffer'`` or
+            ``'regex'`` (default ``'buffer'``).
+        spool_size (int): Keep in memory the attachments up to these bytes
+            and write to disk only the bigger ones (default None, always on disk).
+        progress (Progress, dict): Throttling policy of the progress events,
+            a :class:`Progress` or a dict of its arguments (``step``,
+            ``interval``, ``percent``) (default None, an event per chunk).
+    """
+    events = []
+    """([(str, function)]): list of tuples contaning the event name and the relative function.
+    """
+
+    params_mapping = {}
+    """(dict): Dictionary with mapping for client attributes or
+            methods to service command parmaters.
+    """
+
+    processors = []
+    """([function]): list of functions that can process
+            and/or modify responses before they are returned.
+    """
+
+    services = []
+    """([str]): list of service names"""
+
+    _headers = {}
+    """(dict): Dictionary with base headers."""
+
+    def __init__(
+            self, url, services=None, headers=None, events=None, processors=None,
+            params_mapping=None, raise_for_fault=False, auth=None, proxies=None,
+            verify=True, response_class=None, description_cache=None,
+            timeout=None, method_timeouts=None, reader_engine=None,
+            spool_size=None, progress=None, **kwargs):
+        if aiohttp is None:
+            raise ImportError(
+                "AsyncJsonWspClient needs aiohttp "
+                "(pip install jsonwspclient[async])")
+        self._rcls = response_class or AsyncJsonWspResponse
+        self.session = None
+        self.url = url
+        self.processors = processors or self.__class__.processors
+        self._raise_for_fault = raise_for_fault
+        self.description_cache = get_description_cache(description_cache)
+        self.timeout = timeout
+        self.method_timeouts = method_timeouts or {}
+        if reader_engine is not None and reader_engine not in ASYNC_READERS:
+            raise ValueError("Unknown reader engine {}".format(reader_engine))
+        self.progress = utils.get_progress(progress)
+        self.reader_options = {
+            name: value for name, value in dict(
+                engine=reader_engine, spool_size=spool_size,
+                progress=self.progress).items()
+            if value is not None}
+        self._observer = utils.Observer(events or self.__class__.events)
+        self._auth = aiohttp.BasicAuth(*auth) if isinstance(
+            auth, (tuple, list)) else auth
+        self._proxies = proxies or {}
+        if isinstance(verify, str):
+            self._ssl = ssl.create_default_context(cafile=verify)
+        else:
+            self._ssl = None if verify else False
+        version, release = __version__.split('.', 1)
+        self.headers = CaseInsensitiveDict({
+            "User-Agent": "JSONWspClient/{} ({}; rev: {})".format(
+                version, platform.platform(), release),
+            "Content-type": "application/json, charset=UTF-8",
+            "Accept": "application/json,multipart/related"
+        })
+        self.trigger = self._observer.trigger
+        self.headers.update(self.__class__._headers)
+        self.headers.update(headers or {})
+        self.extras = kwargs
+        self.services = services or self.__class__.services
+        self._services = {}
+        self._methods = {}
+        self.params_mapping = utils.ParamsMapping(
+            params_mapping or self.__class__.params_mapping)
+        self.last_response = None
+        self.add_event = self._observer.add
+        self.remove_event = self._observer.remove
+
+    def add_events(self, *events):
+        """Add events."""
+        for event, funct in events:
+            self._observer.add(event, funct)
+
+    def remove_events(self, *events):
+        """Remove events."""
+        for event, funct in events:
+            self._observer.remove(event, funct)
+
+    def service(self, name):
+        """return service.
+
+        Args:
+            name (str): name of the service to retrieve
+
+        Returns:
+            AsyncJsonWspService: the service object
+        """
+        return self._services.get(name.lower())
+
+    def method(self, name):
+        """return method.
+
+        Args:
+            name (str): name of the service to retrieve
+
+        Returns:
+            function: the services method if possible.
+        """
+        return self._methods.get(name)
+
+    async def load(self):
+        """Load all the services descriptions.
+
+        Descriptions are fetched concurrently but methods are merged in the
+        services order so the first service wins on name collisions.
+
+        Returns:
+            AsyncJsonWspClient: the client itself.
+        """
+        services = [AsyncJsonWspService(self, name) for name in self.services]
+        await asyncio.gather(*[srv._load_description() for srv in services])
+        for srv in services:
+            self._services[srv.name.lower()] = srv
+            for method_name, method in list(srv.list_methods().items()):
+                if not method_name in self._methods:
+                    self._methods[method_name] = method
+        utils.set_methods(self, self._methods)
+        return self
+
+    def _get_session(self):
+        """Return the aiohttp session (created on first use)."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                auth=self._auth,
+                connector=aiohttp.TCPConnector(ssl=self._ssl))
+        return self.session
+
+    def _client_timeout(self, timeout, deadline):
+        """Return the aiohttp timeout for the request (if any)."""
+        timeout = self.timeout if timeout is None else timeout
+        total = None
+        if deadline is not None:
+            total = deadline - time.monotonic()
+            if total <= 0:
+                raise excs.DeadlineExceeded("Deadline exceeded")
+        elif timeout is None:
+            return None
+        connect, read = timeout if isinstance(timeout, tuple) else (
+            timeout, timeout)
+        return aiohttp.ClientTimeout(
+            total=total, sock_connect=connect, sock_read=read)
+
+    async def _send(self, method, path, timeout=None, deadline=None, **kwargs):
+        """Send the request and return the processed response."""
+        url = urljoin(self.url, path)
+        client_timeout = self._client_timeout(timeout, deadline)
+        if client_timeout is not None:
+            kwargs['timeout'] = client_timeout
+        raw = await self._get_session().request(
+            method, url, proxy=self._proxies.get(urlparse(url).scheme),
+            **kwargs)
+        self.trigger('response', raw)
+        if deadline is None:
+            return await self._rcls(
+                raw, self.trigger, **self.reader_options)._aprocess()
+        return await self._rcls(
+            raw, self.trigger, deadline=deadline,
+            **self.reader_options)._aprocess()
+
+    async def post(self, path, data=None, method='POST', headers=None,
+                   timeout=None, deadline=None):
+        """Post a request.
+
+        Args:
+            path (str): Path relative to base url of the client instance.
+            data (dict): Dictionary with data to post (will be convert into json string).
+            method (str): Method to use (default to POST)
+            headers (dict, optional): Additional headers for this request.
+            timeout (float, tuple, optional): Request timeout (default client timeout).
+            deadline (float, optional): :func:`time.monotonic` time by which
+                the whole response must be read.
+
+        Returns:
+            AsyncJsonWspResponse: The response to the request.
+        """
+        self.trigger(
+            'client.post.before', client=self, path=path, data=data,
+            method=method)
+        response = await self._send(
+            method, path, timeout=timeout, deadline=deadline, json=data,
+            headers=dict(self.headers, **(headers or {})))
+        self.trigger(
+            'client.post.after', client=self, path=path, data=data,
+            method=method, response=response)
+        self.last_response = response
+        return response
+
+    async def post_mp(self, path, data=None, attachs=None, method="POST",
+                      timeout=None, deadline=None):
+        """Post a multipart requests.
+
+        Args:
+            path (str): Path relative to base url of the client instance.
+            data (dict): Dictionary with data to post (will be convert into json string).
+            attachs (dict): Dictionary with files id and relative file object
+                or iterable of bytes. ({fileid: fileobject}), if some size is
+                unknown the request is sent with chunked transfer encoding.
+            method (str): Method to use (default to POST)
+            timeout (float, tuple, optional): Request timeout (default client timeout).
+            deadline (float, optional): :func:`time.monotonic` time by which
+                the whole response must be read.
+
+        Returns:
+            AsyncJsonWspResponse: The response to the request.
+        """
+        self.trigger(
+            'client.post_mp.before', client=self, path=path, data=data,
+            attachs=attachs, method=method)
+        stream = MultiPartWriter(
+            data, attachs, callback=self.trigger, progress=self.progress)
+        headers = CaseInsensitiveDict(self.headers)
+        headers.update({k: v.decode() for k, v in stream.headers.items()})
+        if stream.length is not None:
+            headers['Content-Length'] = str(stream.length)
+        stream = utils.FileWithCallBack(
+            stream, self.trigger, size=stream.length, progress=self.progress)
+
+        async def body():
+            """Stream the multipart body."""
+            while True:
+                chunk = stream.read(8192)
+                if not chunk:
+                    break
+                yield chunk
+        try:
+            response = await self._send(
+                method, path, timeout=timeout, deadline=deadline,
+                data=body(), headers=headers)
+        finally:
+            stream.close()
+        self.trigger(
+            'client.post_mp.after', client=self, path=path, data=data,
+            attachs=attachs, method=method, response=response)
+        self.last_response = response
+        return response
+
+    async def close(self):
+        """Close."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __getattr__(self, name):
+        if name in self._methods:
+            return self._methods[name]
+        if name.lower() in self._services:
+            return self._services[name.lower()]
+        return super().__getattribute__(name)
+
+    def __dir__(self):
+        return sorted(list(set(
+            list(self.__class__.__dict__) +
+            list(self.__dict__) +
+            list(self._methods) +
+            list(self._services)
+        )))
+
+    async def __aenter__(self):
+        return await self.load()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
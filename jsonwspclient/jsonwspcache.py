@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+==============================================
+Jsonwspcache :mod:`jsonwspclient.jsonwspcache`
+==============================================
+
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+
+log = logging.getLogger('jsonwspclient')
+
+
+class DescriptionCache:
+    """On disk cache for the services descriptions.
+
+    Descriptions are stored by base url and service name. A fresh entry
+    (younger than ``ttl``) is used without any request, a stale one is
+    revalidated with ``If-None-Match``/``If-Modified-Since`` if the server
+    gave us an ``ETag`` or a ``Last-Modified`` header.
+
+    Args:
+        path (str, optional): cache folder (default
+            ``$XDG_CACHE_HOME/jsonwspclient`` or ``~/.cache/jsonwspclient``,
+            private to the user).
+        ttl (int, float, optional): seconds an entry is fresh (default 3600).
+    """
+
+    def __init__(self, path=None, ttl=3600):
+        self.path = path or os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.expanduser(os.path.join('~', '.cache')), 'jsonwspclient')
+        """(str): cache folder."""
+        self.ttl = ttl
+        """(int, float): seconds an entry is fresh."""
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+    def _filename(self, url, service):
+        """Return the entry file name."""
+        key = md5('{}\n{}'.format(url, service).encode('UTF-8')).hexdigest()
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, url, service):
+        """Return the cached entry or None.
+
+        Args:
+            url (str): client base url.
+            service (str): service name.
+
+        Returns:
+            dict: entry with ``description``, ``etag``, ``last_modified`` and
+                ``stored`` keys.
+        """
+        try:
+            with open(self._filename(url, service), 'r') as fobj:
+                return json.load(fobj)
+        except (IOError, ValueError):
+            return None
+
+    def set(self, url, service, description, etag=None, last_modified=None):
+        """Store the description.
+
+        Args:
+            url (str): client base url.
+            service (str): service name.
+            description (dict): service description.
+            etag (str, optional): ``ETag`` response header.
+            last_modified (str, optional): ``Last-Modified`` response header.
+
+        Returns:
+            dict: the stored entry.
+        """
+        entry = dict(
+            description=description, etag=etag, last_modified=last_modified,
+            stored=time.time())
+        filename = self._filename(url, service)
+        descriptor, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as fobj:
+                json.dump(entry, fobj)
+            os.replace(tmp_path, filename)
+        except (IOError, OSError) as error:
+            log.debug('Unable to cache description %s', error)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return entry
+
+    def touch(self, url, service, entry):
+        """Mark a revalidated entry as fresh."""
+        return self.set(
+            url, service, entry['description'], entry.get('etag'),
+            entry.get('last_modified'))
+
+    def is_fresh(self, entry):
+        """Return True if the entry is younger than ttl."""
+        return time.time() - entry.get('stored', 0) < self.ttl
+
+    @staticmethod
+    def validators(entry):
+        """Return the headers to revalidate the entry."""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def clear(self):
+        """Remove all the entries."""
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.path, name))
+
+
+class ResponseCache:
+    """In memory LRU cache for the responses of idempotent methods.
+
+    Responses are copied both when they are stored and when they are
+    returned, so callers never share the JSON data of a cached response.
+
+    Args:
+        ttl (int, float, optional): seconds a response is valid (default 60).
+        maxsize (int, optional): max number of responses (default 256).
+
+    Attributes:
+
+        hits (int): number of cache hits.
+        misses (int): number of cache misses.
+    """
+
+    def __init__(self, ttl=60, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Return a canonical key for parts."""
+        return json.dumps(
+            parts, sort_keys=True, separators=(',', ':'), default=repr)
+
+    def get(self, key):
+        """Return a copy of the cached response or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[1].copy()
+
+    def set(self, key, response):
+        """Store a copy of the response."""
+        response = response.copy()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all the responses."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hits, misses and size of the cache."""
+        with self._lock:
+            return dict(
+                hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_description_cache(cache):
+    """Return a DescriptionCache from a cache instance or folder path."""
+    if cache is None or isinstance(cache, DescriptionCache):
+        return cache
+    return DescriptionCache(cache)
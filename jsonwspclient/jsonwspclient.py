@@ -6,14 +6,23 @@ Jsonwspclient :mod:`jsonwspclient.jsonwspclient`
 
 """
 import logging
+import os
 import platform
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait)
 
 import pkg_resources
 import requests
 from requests.compat import urljoin
 
+from . import jsonwspexceptions as excs
 from . import jsonwsputils as utils
-from .jsonwspmultipart import MultiPartWriter
+from .jsonwspcache import ResponseCache, get_description_cache
+from .jsonwspmultipart import READERS, IterStream, MultiPartWriter
+from .jsonwsppool import PoolingAdapter
 from .jsonwspresponse import JsonWspResponse
 from .jsonwspservice import JsonWspService
 
@@ -24,6 +33,39 @@ except:
     __version__ = '2.0.1'
 
 
+def _counted(value, readers, buffers):
+    """Return a copy of the params value with the attachments readers
+    wrapped in :class:`CountingReader` (and ``'@path'`` files opened).
+
+    Args:
+        value (any): params value.
+        readers (list): receives the new readers.
+        buffers (list): receives the sizes of the buffers.
+
+    Returns:
+        any: the new value.
+    """
+    if isinstance(value, dict):
+        return {key: _counted(item, readers, buffers)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_counted(item, readers, buffers) for item in value]
+    if isinstance(value, str):
+        if not (value[:1] == '@' and os.path.isfile(value[1:])):
+            return value
+        value = open(value[1:], 'rb')
+    elif utils.is_buffer(value):
+        buffers.append(memoryview(value).nbytes)
+        return value
+    elif isinstance(value, Iterator) and not hasattr(value, 'read'):
+        value = IterStream(value)
+    elif not hasattr(value, 'read'):
+        return value
+    reader = utils.CountingReader(value)
+    readers.append(reader)
+    return reader
+
+
 class JsonWspClient:
     """JsonWsp Client.
 
@@ -50,6 +92,52 @@ class JsonWspClient:
             it must be a path to a CA bundle to use. (see
             `Requests SSL Cert Verification <http://docs.python-requests.org/en/master/user/advanced/?highlight=ssl#ssl-cert-verification>`_).
         response_class (JsonWspResponse subclass): Custom Response class wich subclass JsonWspResponse (default JsonWspResponse).
+        description_cache (DescriptionCache, str): cache for the services
+            descriptions (or the path of the cache folder).
+        lazy (bool): Load the services descriptions only when a service or
+            one of its methods is used for the first time (default False),
+            methods of descriptions not loaded nor cached are available
+            only through :meth:`method`.
+        load_workers (int): Number of threads used to load the services
+            descriptions concurrently (default None, one after another).
+        thread_safe (bool): Thread safe mode, the client can be shared by
+            more threads and :attr:`last_response` is per thread (default False).
+        threads (int): Number of threads sharing the client in thread safe
+            mode, used to size the connections pool (default 10).
+        pool_connections (int): Number of connection pools to cache (default 10).
+        pool_maxsize (int): Max number of connections kept in each pool
+            (default 10 or ``threads`` in thread safe mode).
+        pool_block (bool): Wait for a free connection instead of opening a
+            new one when the pool is exhausted (default False).
+        pool_idle_timeout (int, float): Close the connections idle for more
+            than these seconds instead of reusing them (default None).
+        timeout (float, tuple): Default timeout for the requests, seconds or
+            a (connect, read) tuple (default None, wait forever).
+        method_timeouts (dict): Timeouts for specific methods by method name.
+        cache_methods ([str]): Names of the idempotent methods whose responses
+            can be cached (default None, no cache).
+        cache_ttl (int, float): Seconds a cached response is valid (default 60).
+        cache_size (int): Max number of cached responses (default 256).
+        coalesce (bool): Identical concurrent calls (without attachments or
+            mirror) share a single request (default False).
+        reader_engine (str): Multipart reader engine, ``'buffer'`` or
+            ``'regex'`` (default ``'buffer'``).
+        spool_size (int): Keep in memory the attachments up to these bytes
+            and write to disk only the bigger ones (default None, always on disk).
+        writer_queue (int): Write the attachments from a background thread
+            fed by a queue of these many chunks, so network reads and disk
+            writes overlap (default None, write while reading).
+        progress (Progress, dict): Throttling policy of the progress events,
+            a :class:`Progress` or a dict of its arguments (``step``,
+            ``interval``, ``percent``) (default None, an event per chunk).
+        background_events ([str]): Names (or first parts) of the events
+            delivered by a background thread instead of the triggering one
+            (default None, all events are delivered synchronously).
+        events_queue_size (int): Size of the background events queue
+            (default 1024).
+        events_overflow (str): What to do with a background event when the
+            queue is full: ``'block'``, ``'drop'`` or ``'sample'`` (default
+            ``'block'``).
     """
     events = []
     """([(str, function)]): list of tuples contaning the event name and the relative function.
@@ -74,15 +162,35 @@ class JsonWspClient:
     def __init__(
             self, url, services=None, headers=None, events=None, processors=None,
             params_mapping=None, raise_for_fault=False, auth=None, proxies=None,
-            verify=True, response_class=None, **kwargs):
+            verify=True, response_class=None, description_cache=None,
+            lazy=False, load_workers=None, thread_safe=False, threads=10,
+            pool_connections=10, pool_maxsize=None, pool_block=False,
+            pool_idle_timeout=None, timeout=None, method_timeouts=None,
+            cache_methods=None, cache_ttl=60, cache_size=256, coalesce=False,
+            reader_engine=None, spool_size=None, writer_queue=None,
+            progress=None, background_events=None, events_queue_size=1024,
+            events_overflow='block', **kwargs):
         #: response class
         self._rcls = response_class or JsonWspResponse
+        self.description_cache = get_description_cache(description_cache)
         self.session = requests.Session()
         self.session.auth = auth
+        self._local = threading.local() if thread_safe else None
+        self._adapter = PoolingAdapter(
+            idle_timeout=pool_idle_timeout,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize or (threads if thread_safe else 10),
+            pool_block=pool_block)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
         self.url = url
         self.processors = processors or self.__class__.processors
         self._raise_for_fault = raise_for_fault
-        self._observer = utils.Observer(events or self.__class__.events)
+        self.event_dispatcher = utils.EventDispatcher(
+            background_events, events_queue_size,
+            events_overflow) if background_events else None
+        self._observer = utils.Observer(
+            events or self.__class__.events, self.event_dispatcher)
         version, release = __version__.split('.', 1)
         self.session.proxies.update(proxies or {})
         self.session.headers.update({
@@ -96,16 +204,50 @@ class JsonWspClient:
         self.session.headers.update(headers or {})
         self.session.verify = verify
         self.session.stream = True
+        self.timeout = timeout
+        self.method_timeouts = method_timeouts or {}
+        self.cache_methods = frozenset(cache_methods or ())
+        self.response_cache = ResponseCache(
+            cache_ttl, cache_size) if self.cache_methods else None
+        self.single_flight = utils.SingleFlight() if coalesce else None
+        if reader_engine is not None and reader_engine not in READERS:
+            raise ValueError("Unknown reader engine {}".format(reader_engine))
+        self.progress = utils.get_progress(progress)
+        self.reader_options = {
+            name: value for name, value in dict(
+                engine=reader_engine, spool_size=spool_size,
+                writer_queue=writer_queue, progress=self.progress).items()
+            if value is not None}
         self.extras = kwargs
         self.services = services or self.__class__.services
         self._services = {}
         self._methods = {}
-        self.params_mapping = params_mapping or self.__class__.params_mapping
+        self._lazy = lazy
+        self._load_lock = threading.RLock()
+        self._load_locks = {}
+        self._load_workers = load_workers
+        self.params_mapping = utils.ParamsMapping(
+            params_mapping or self.__class__.params_mapping)
         self.last_response = None
         self.add_event = self._observer.add
         self.remove_event = self._observer.remove
-        for service in self.services:
-            self._load_service(service)
+        if not lazy:
+            self.preload()
+
+    @property
+    def last_response(self):
+        """(JsonWspResponse): last response (of the current thread in thread safe mode)."""
+        if self._local is not None:
+            return getattr(self._local, 'last_response', None)
+        return self._last_response
+
+    @last_response.setter
+    def last_response(self, response):
+        """last_response setter"""
+        if self._local is not None:
+            self._local.last_response = response
+        else:
+            self._last_response = response
 
     @property
     def headers(self):
@@ -119,6 +261,15 @@ class JsonWspClient:
         """headers setter"""
         self.session.headers = headers
 
+    def pool_stats(self):
+        """Return the connections pool statistics.
+
+        Returns:
+            dict: ``active``, ``idle``, ``created`` and ``discarded`` connections.
+        """
+        self._adapter.reap()
+        return self._adapter.stats.as_dict()
+
     def add_events(self, *events):
         """Add events."""
         for event, funct in events:
@@ -138,7 +289,14 @@ class JsonWspClient:
         Returns:
             JsonWspService: the service object
         """
-        return self._services.get(name)
+        srv = self._services.get(name.lower())
+        if srv is None and self._lazy:
+            for service in self.services:
+                if service.lower() == name.lower():
+                    srv = self._load_service(service)
+                    self._merge_methods()
+                    break
+        return srv
 
     def method(self, name):
         """return method.
@@ -149,15 +307,155 @@ class JsonWspClient:
         Returns:
             function: the services method if possible.
         """
-        return self._methods.get(name)
+        method = self._methods.get(name)
+        if method is None and self._lazy:
+            # load the services in order until we find the method so the
+            # first service still wins on name collisions.
+            for service in self.services:
+                if service.lower() in self._services:
+                    continue
+                self._load_service(service)
+                self._merge_methods()
+                method = self._methods.get(name)
+                if method is not None:
+                    break
+        return method
+
+    def call_many(self, calls, max_workers=10, ordered=True):
+        """Call many service methods concurrently.
+
+        Errors don't stop the batch: the raised exception takes the place
+        of the response of the failed call.
+
+        Args:
+            calls ([(str, dict)]): list of tuples with the method name and
+                the relative params dictionary.
+            max_workers (int): max number of concurrent calls (default 10).
+            ordered (bool): if True returns the results in the calls order
+                else yields ``(index, result)`` tuples as they complete.
+
+        Returns:
+            list: responses (or exceptions) in the calls order.
+        """
+        calls = list(calls)
+        if not ordered:
+            return self._iter_many(calls, max_workers)
+        results = [None] * len(calls)
+        for index, result in self._iter_many(calls, max_workers):
+            results[index] = result
+        return results
+
+    def _iter_many(self, calls, max_workers):
+        """Yield (index, result) for the calls as they complete."""
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(calls)))) as executor:
+            futures = {
+                executor.submit(self._call_one, method_name, kwargs): index
+                for index, (method_name, kwargs) in enumerate(calls)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _call_one(self, method_name, kwargs):
+        """Call a method returning the exception instead of raising it."""
+        try:
+            method = self.method(method_name)
+            if method is None:
+                raise excs.ParamsError(
+                    'Unknown method "{}"'.format(method_name))
+            # methods change the params dictionary so we pass a copy.
+            return method(**dict(kwargs or {}))
+        except Exception as error:
+            return error
+
+    def upload_many(self, uploads, max_workers=4):
+        """Upload many files concurrently.
+
+        Uploads are taken from ``uploads`` only when a worker is free, so
+        at most ``max_workers`` of them (and their files) are open at the
+        same time: ``'@path'`` values are opened when the upload starts and
+        file objects are closed as soon as their upload is done.
+
+        Args:
+            uploads ([(str, dict)]): iterable of tuples with the method name
+                and the relative params dictionary (file objects, ``'@path'``
+                strings, buffers...).
+            max_workers (int): max number of concurrent uploads (default 4).
+
+        Returns:
+            dict: ``results`` (a dict with ``response``, or the exception,
+                ``bytes`` and ``elapsed`` for every upload, in the uploads
+                order), total ``bytes``, ``elapsed`` seconds and
+                ``throughput`` in bytes per second.
+        """
+        max_workers = max(1, max_workers)
+        results = {}
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            for index, (method_name, kwargs) in enumerate(uploads):
+                if len(pending) >= max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[pending.pop(future)] = future.result()
+                future = executor.submit(self._upload_one, method_name, kwargs)
+                pending[future] = index
+            for future in as_completed(pending):
+                results[pending[future]] = future.result()
+        elapsed = time.monotonic() - start
+        sent = sum(result['bytes'] for result in results.values())
+        return dict(
+            results=[results[index] for index in sorted(results)],
+            bytes=sent, elapsed=elapsed,
+            throughput=sent / elapsed if elapsed else 0.0)
+
+    def _upload_one(self, method_name, kwargs):
+        """Upload counting the bytes sent and closing the files of kwargs."""
+        readers = []
+        buffers = []
+        kwargs = _counted(kwargs, readers, buffers)
+        start = time.monotonic()
+        try:
+            response = self._call_one(method_name, kwargs)
+        finally:
+            for reader in readers:
+                reader.close()
+        sent = sum(reader.count for reader in readers)
+        if not isinstance(response, Exception):
+            # buffers are sent as slices, all of them if the call went well.
+            sent += sum(buffers)
+        return dict(
+            response=response, bytes=sent, elapsed=time.monotonic() - start)
+
+    def preload(self):
+        """Load all the services not loaded yet.
 
-    def post(self, path, data=None, method='POST'):
+        Returns:
+            JsonWspClient: the client itself.
+        """
+        pending = [service for service in self.services
+                   if service.lower() not in self._services]
+        if self._load_workers and len(pending) > 1:
+            with ThreadPoolExecutor(
+                    max_workers=min(self._load_workers, len(pending))) as executor:
+                list(executor.map(self._load_service, pending))
+        else:
+            for service in pending:
+                self._load_service(service)
+        self._merge_methods()
+        return self
+
+    def post(self, path, data=None, method='POST', headers=None, timeout=None,
+             deadline=None):
         """Post a request.
 
         Args:
             path (str): Path relative to base url of the client instance.
             data (dict): Dictionary with data to post (will be convert into json string).
             method (str): Method to use (default to POST)
+            headers (dict, optional): Additional headers for this request.
+            timeout (float, tuple, optional): Request timeout (default client timeout).
+            deadline (float, optional): :func:`time.monotonic` time by which
+                the whole response must be read.
 
         Returns:
             JsonWspResponse: The response to the request.
@@ -169,24 +467,31 @@ class JsonWspClient:
             requests.Request(
                 method,
                 urljoin(self.url, path),
+                headers=headers,
                 json=data,
                 hooks={'response': self.trigger}
             ))
-        response = self._rcls(self.session.send(request), self.trigger)
+        response = self._send(request, timeout, deadline)
         self.trigger(
             'client.post.after', client=self, path=path, data=data,
             method=method, response=response)
         self.last_response = response
         return response
 
-    def post_mp(self, path, data=None, attachs=None, method="POST"):
+    def post_mp(self, path, data=None, attachs=None, method="POST",
+                timeout=None, deadline=None):
         """Post a multipart requests.
 
         Args:
             path (str): Path relative to base url of the client instance.
             data (dict): Dictionary with data to post (will be convert into json string).
-            attachs (dict): Dictionary with files id and relative file object. ({fileid: fileobject})
+            attachs (dict): Dictionary with files id and relative file object
+                or iterable of bytes. ({fileid: fileobject}), if some size is
+                unknown the request is sent with chunked transfer encoding.
             method (str): Method to use (default to POST)
+            timeout (float, tuple, optional): Request timeout (default client timeout).
+            deadline (float, optional): :func:`time.monotonic` time by which
+                the whole response must be read.
 
         Returns:
             JsonWspResponse: The response to the request.
@@ -194,8 +499,10 @@ class JsonWspClient:
         self.trigger(
             'client.post_mp.before', client=self, path=path, data=data,
             attachs=attachs, method=method)
-        stream = MultiPartWriter(data, attachs)
-        stream = utils.FileWithCallBack(stream, self.trigger, size=len(stream))
+        stream = MultiPartWriter(
+            data, attachs, callback=self.trigger, progress=self.progress)
+        stream = utils.FileWithCallBack(
+            stream, self.trigger, size=stream.length, progress=self.progress)
         request = self.session.prepare_request(
             requests.Request(
                 method=method,
@@ -204,8 +511,10 @@ class JsonWspClient:
                 data=stream,
                 hooks={'response': self.trigger}
             ))
-        response = self._rcls(self.session.send(request), self.trigger)
-        stream.close()
+        try:
+            response = self._send(request, timeout, deadline)
+        finally:
+            stream.close()
         self.trigger(
             'client.post_mp.after', client=self, path=path, data=data,
             attachs=attachs, method=method, response=response)
@@ -213,22 +522,89 @@ class JsonWspClient:
         return response
 
     def close(self):
-        """Close."""
+        """Close (after delivering the queued background events)."""
+        if self.event_dispatcher is not None:
+            self.event_dispatcher.close()
         self.session.close()
 
+    def _send(self, request, timeout=None, deadline=None):
+        """Send the prepared request and return the response."""
+        timeout = self.timeout if timeout is None else timeout
+        if deadline is None:
+            return self._rcls(
+                self.session.send(request, timeout=timeout), self.trigger,
+                **self.reader_options)
+        timeout = utils.limit_timeout(timeout, deadline)
+        if timeout is None:
+            raise excs.DeadlineExceeded("Deadline exceeded", request=request)
+        return self._rcls(
+            self.session.send(request, timeout=timeout), self.trigger,
+            deadline=deadline, **self.reader_options)
+
     def _load_service(self, service):
-        """Load service."""
-        srv = JsonWspService(self, service)
-        self._services[service.lower()] = srv
-        for method_name, method in list(srv.list_methods().items()):
-            if not method_name in self._methods:
-                self._methods[method_name] = method
+        """Load service (only once)."""
+        srv = self._services.get(service.lower())
+        if srv is None:
+            # one lock per service so different services load concurrently.
+            with self._load_lock:
+                lock = self._load_locks.setdefault(
+                    service.lower(), threading.Lock())
+            with lock:
+                srv = self._services.get(service.lower())
+                if srv is None:
+                    start = time.perf_counter()
+                    srv = JsonWspService(self, service)
+                    self._services[service.lower()] = srv
+                    self.trigger(
+                        'client.service_loaded', client=self, service=srv,
+                        elapsed=time.perf_counter() - start)
+        return srv
+
+    def _merge_methods(self):
+        """Merge the methods of the loaded services.
+
+        Only the services loaded in a row from the first one are merged,
+        so a method name always belongs to the first service which has it.
+        """
+        with self._load_lock:
+            methods = {}
+            for service in self.services:
+                srv = self._services.get(service.lower())
+                if srv is None:
+                    break
+                for method_name, method in list(srv.list_methods().items()):
+                    if not method_name in methods:
+                        methods[method_name] = method
+            self._methods = methods
+            utils.set_methods(self, methods)
+
+    def _known_method(self, name):
+        """Return True if a loaded (or cached) description has the method."""
+        for service in self.services:
+            srv = self._services.get(service.lower())
+            if srv is not None:
+                methods = srv.list_methods()
+            elif self.description_cache is not None:
+                entry = self.description_cache.get(self.url, service)
+                methods = entry['description']['methods'] if entry else ()
+            else:
+                continue
+            if name in methods:
+                return True
+        return False
 
     def __getattr__(self, name):
         if name in self._methods:
             return self._methods[name]
         if name.lower() in self._services:
             return self._services[name.lower()]
+        if self._lazy and not name.startswith('__'):
+            # only known names load descriptions (not hasattr probes).
+            item = self.service(name)
+            if item is None and self._known_method(name):
+                item = self.method(name)
+            if item is not None:
+                return item
         return super().__getattribute__(name)
 
     def __dir__(self):
@@ -5,6 +5,9 @@ Jsonwspexceptions :mod:`jsonwspclient.jsonwspexceptions`
 ========================================================
 
 """
+import requests
+
+
 class JsonWspException(Exception):
     """Base Exception"""
     pass
@@ -59,3 +62,8 @@ class IncompatibleFault(JsonWspFault):
 class ParamsError(JsonWspException):
     """Params Errror."""
     pass
+
+
+class DeadlineExceeded(JsonWspException, requests.Timeout):
+    """The call deadline has been exceeded."""
+    pass
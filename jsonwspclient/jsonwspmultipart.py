@@ -6,18 +6,25 @@ Jsonwspmultipart :mod:`jsonwspclient.jsonwspmultipart`
 
 """
 
+import io
 import json
 import logging
+import mmap
 import os
+import queue
 import re
 import shutil
 import tempfile
+import threading
 import time
 import uuid
+import weakref
 from hashlib import md5
 
 from requests.structures import CaseInsensitiveDict
 
+from . import jsonwspexceptions as excs
+
 from . import jsonwsputils as utils
 
 log = logging.getLogger('jsonwspclient')
@@ -45,6 +52,32 @@ class JsonWspAttachmentMeta(type):
         return isinstance(JsonWspAttachment, other)
 
 
+def write_all(descriptor, data):
+    """Write all data (bytes or any bytes-like object) to the file descriptor."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(descriptor, view):]
+
+
+def attachment_filter(accept):
+    """Return a predicate over the attachment headers.
+
+    Args:
+        accept (set, function): content ids (with or without ``cid:``) of
+            the attachments to keep or a function which receives the
+            attachment headers and returns True to keep it.
+
+    Returns:
+        function: the predicate (None if accept is None).
+    """
+    if accept is None or callable(accept):
+        return accept
+    ids = frozenset(
+        att_id[4:] if att_id.startswith('cid:') else att_id
+        for att_id in accept)
+    return lambda headers: headers.get('content-id', '').strip() in ids
+
+
 def void_callback(_event_name, **_kwargs):
     """Void callback"""
     pass
@@ -56,17 +89,26 @@ class JsonWspAttachment(metaclass=JsonWspAttachmentMeta):
     Args:
 
         index (int): Attachment index.
+        spool_size (int, optional): keep the attachment in memory until it
+            is bigger than these bytes (default 0, always on disk).
+        headers (dict, optional): attachment headers.
+        destination (function, optional): function which receives the
+            attachment and returns the final path where to write it
+            directly (or None to use a temporary file).
+        sink (function, optional): sink factory, function which receives
+            the attachment id and headers and returns a writable for the
+            attachment data (or None to use a temporary file).
 
     Attributes:
 
         descriptor (any): File descriptor.
-        path (str): Temporary file path.
     """
 
-    def __init__(self, index=0, callback=None):
+    def __init__(self, index=0, callback=None, spool_size=0, headers=None,
+                 destination=None, sink=None):
         self.att_id = ''
         """(str): Attachment id."""
-        self.descriptor, self.path = tempfile.mkstemp(prefix='content_')
+        self.descriptor = None
         self.filename = None
         """(str): filename if found in headers."""
         self.headers = CaseInsensitiveDict()
@@ -75,11 +117,65 @@ class JsonWspAttachment(metaclass=JsonWspAttachmentMeta):
         """(int): Attachment index."""
         self.size = 0
         """(int): Attachment size."""
+        if headers:
+            self.update(headers)
+        self.target = None
+        """(str): final path if the attachment has been written or moved
+        to its destination."""
+        self.sink = sink(self.att_id, self.headers) if sink else None
+        """(any): writable which received the attachment data."""
+        self.result = None
+        """(any): value returned by the sink ``close`` method."""
         self._callback = callback or void_callback
+        self._maps = weakref.WeakSet()
+        self._partial = None
+        self._path = None
+        self._spool = None
+        self._spool_size = spool_size
+        if self.sink is None:
+            self._create(destination(self) if destination else None)
+
+    def _create(self, target=None):
+        """Create the storage for the attachment data."""
+        if target:
+            self._partial = target + '.partial'
+            self.descriptor = os.open(
+                self._partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            self.target = target
+        elif self._spool_size:
+            self._spool = bytearray()
+        else:
+            self.descriptor, self._path = tempfile.mkstemp(prefix='content_')
+
+    @property
+    def in_memory(self):
+        """(bool): True if the attachment is kept in memory."""
+        return self._spool is not None
+
+    @property
+    def path(self):
+        """(str): Temporary file path (an in memory attachment is written
+        to disk first)."""
+        if self._spool is not None:
+            self._spill()
+        return self._path
+
+    def _spill(self, keep_open=False):
+        """Move the in memory data to a temporary file."""
+        descriptor, self._path = tempfile.mkstemp(prefix='content_')
+        write_all(descriptor, self._spool)
+        self._spool = None
+        if keep_open:
+            self.descriptor = descriptor
+        else:
+            os.close(descriptor)
 
     @property
     def length(self):
         """length"""
+        if self._spool is not None:
+            self.size = len(self._spool)
+            return self.size
         try:
             self.size = os.fstat(self.descriptor).st_size
         except:
@@ -96,6 +192,18 @@ class JsonWspAttachment(metaclass=JsonWspAttachmentMeta):
             filename = self.headers.get('x-filename')
         self.filename = filename or self.filename
 
+    def write(self, data):
+        """Write data (bytes or any bytes-like object) to the attachment."""
+        if self.sink is not None:
+            self.sink.write(data)
+            return
+        if self._spool is not None:
+            if len(self._spool) + len(data) <= self._spool_size:
+                self._spool += data
+                return
+            self._spill(keep_open=True)
+        write_all(self.descriptor, data)
+
     def close(self):
         """Try to close the temp file."""
         try:
@@ -108,6 +216,56 @@ class JsonWspAttachment(metaclass=JsonWspAttachmentMeta):
         except:
             pass
 
+    def finish(self):
+        """Close the attachment once completely written (an attachment
+        written to its destination is renamed to its final path and a
+        sink is closed)."""
+        if self.sink is not None:
+            close = getattr(self.sink, 'close', None)
+            self.result = close() if close else None
+            return
+        self.close()
+        if self._partial is not None:
+            os.replace(self._partial, self.target)
+            self._path, self._partial = self.target, None
+
+    def remove(self):
+        """Close the attachment and remove its temporary data (the file is
+        kept while some memory map of it is alive). A file written or moved
+        to its :attr:`target` is never removed."""
+        self.close()
+        self._spool = None
+        if any(not data.closed for data in self._maps):
+            log.debug('Attachment %s is mapped, not removed', self._path)
+            return
+        for path in (self._partial, self._path):
+            if path and path != self.target and os.path.exists(path):
+                os.remove(path)
+
+    def mmap(self):
+        """Return a read-only memory map of the attachment data.
+
+        The map can be used as buffer (``numpy.frombuffer``, ``memoryview``,
+        ...) without reading the data in memory, other processes can map
+        the same :attr:`path`. An in memory attachment returns a read-only
+        memoryview of a copy of its data.
+
+        Returns:
+            (mmap.mmap, memoryview): the read-only data.
+        """
+        if self.sink is not None:
+            raise IOError("Attachment data has been sent to a sink")
+        if self._spool is not None:
+            # memoryview.toreadonly() needs python 3.8.
+            return memoryview(bytes(self._spool))
+        with open(self.path, 'rb') as fobj:
+            if not os.fstat(fobj.fileno()).st_size:
+                # empty files can't be mapped.
+                return memoryview(b'')
+            data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.add(data)
+        return data
+
     def open(self, mode='rb'):
         """Open the temp file and return the opened file object
 
@@ -117,10 +275,32 @@ class JsonWspAttachment(metaclass=JsonWspAttachmentMeta):
         Returns:
             (file): the open file.
         """
+        if self.sink is not None:
+            raise IOError("Attachment data has been sent to a sink")
         self.close()
-        self.descriptor = open(self.path, mode)
+        if self._spool is not None and mode == 'rb':
+            self.descriptor = io.BytesIO(self._spool)
+        else:
+            self.descriptor = open(self.path, mode)
         return self.descriptor
 
+    def target_path(self, path, filename=None):
+        """Return the path where to save the attachment.
+
+        Args:
+            path (str): Path where to save the file.
+            filename (str, optional): Name for the file (if not already in path)
+
+        Raises:
+            ValueError: if a filename is not found.
+        """
+        filename = filename or self.filename
+        if os.path.isdir(path):
+            if not filename:
+                raise ValueError("filename needed")
+            path = os.path.join(path, filename)
+        return path
+
     def save(self, path, filename=None, overwrite=True):
         """Save the file to path
 
@@ -138,21 +318,134 @@ class JsonWspAttachment(metaclass=JsonWspAttachmentMeta):
             content-disposition header if one.
 
         """
-        filename = filename or self.filename
-        if os.path.isdir(path):
-            if not filename:
-                raise ValueError("filename needed")
-            path = os.path.join(path, filename)
+        if self.sink is not None:
+            raise IOError("Attachment data has been sent to a sink")
+        path = self.target_path(path, filename)
         if overwrite is False and os.path.exists(path):
             pass
+        elif self._spool is not None:
+            with open(path, 'wb') as fobj:
+                fobj.write(self._spool)
         else:
             shutil.copy(self.path, path)
 
+    def move(self, path, filename=None, overwrite=True):
+        """Move the file to path.
+
+        Like :meth:`save` but the temporary file is renamed instead of
+        copied when it is on the same filesystem of path, the attachment
+        :attr:`path` then is the new one.
+        """
+        path = self.target_path(path, filename)
+        if self.target == path or (
+                overwrite is False and os.path.exists(path)):
+            return
+        if self._spool is not None:
+            return self.save(path, overwrite=overwrite)
+        self.close()
+        try:
+            os.replace(self._path, path)
+        except OSError:
+            # not on the same filesystem.
+            return self.save(path, overwrite=overwrite)
+        self._path = self.target = path
+
+
+class AttachmentWriter(object):
+    """Background thread writing the attachments data.
+
+    Chunks and completions are handled in the order they are queued and
+    the queue size gives backpressure to the reader.
+
+    Args:
+        depth (int): max number of chunks waiting to be written.
+        on_finish (function): function called with every completed attachment.
+    """
+
+    def __init__(self, depth, on_finish):
+        self._error = None
+        self._on_finish = on_finish
+        self._queue = queue.Queue(depth)
+        self._thread = threading.Thread(
+            target=self._run, name='jsonwspclient-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """Write the queued chunks."""
+        while True:
+            attach, data = self._queue.get()
+            if attach is None:
+                break
+            if self._error is not None:
+                # just drain the queue.
+                continue
+            try:
+                if data is None:
+                    attach.finish()
+                    self._on_finish(attach)
+                else:
+                    attach.write(data)
+            except Exception as error:
+                self._error = error
+
+    def _raise(self):
+        """Raise the writing error (if any)."""
+        if self._error is not None:
+            raise self._error
+
+    def write(self, attach, data):
+        """Queue a chunk of the attachment."""
+        self._raise()
+        self._queue.put((attach, data))
+
+    def finish(self, attach):
+        """Queue the completion of the attachment."""
+        self.write(attach, None)
+
+    def stop(self):
+        """Wait for all the queued writes and stop the thread."""
+        if self._thread.is_alive():
+            self._queue.put((None, None))
+            self._thread.join()
+
+    def flush(self):
+        """Wait for all the queued writes, stop the thread and raise the
+        writing error (if any)."""
+        self.stop()
+        self._raise()
+
 
 class MultiPartReader(object):
-    """Reader"""
+    """Reader
+
+    Args:
+        headers (dict): response headers.
+        content (file): file-like object with the response content.
+        size (int, optional): content length.
+        chunk_size (int, optional): bytes to read each time.
+        callback (function, optional): events trigger.
+        deadline (float, optional): :func:`time.monotonic` time by which
+            the whole content must be read.
+        spool_size (int, optional): attachments up to these bytes are kept
+            in memory (default 0, always on disk).
+        destination (function, optional): function which receives a new
+            attachment and returns the path where to write it directly.
+        sink (function, optional): sink factory, function which receives
+            the attachment id and headers and returns a writable for the
+            attachment data.
+        accept (set, function, optional): content ids of the attachments to
+            keep or a predicate over their headers, the other parts are
+            skipped (default None, keep all).
+        writer_queue (int, optional): write the attachments from a
+            background thread with a queue of these many chunks (default
+            0, write while reading).
+        progress (Progress, optional): throttling policy of the
+            ``multipartreader.read`` events.
+    """
 
-    def __init__(self, headers, content, size=None, chunk_size=8192, callback=None):
+    def __init__(self, headers, content, size=None, chunk_size=8192, callback=None,
+                 deadline=None, spool_size=0, destination=None, sink=None,
+                 accept=None, writer_queue=0, progress=None):
         self.attachs = {}
         self.by_id = {}
         self.headers = headers
@@ -160,28 +453,60 @@ class MultiPartReader(object):
         self._attach_headers = b''
         self._attach_size = 0
         self._end_of_stream = False
-        self._attach_end_of_parts = False
-        self._boundary = utils.get_boundary(self.headers).encode()
+        self._boundary = utils.get_boundary(
+            self.headers).encode().replace(b'"', b'')
         self._charset = utils.get_charset(self.headers)
         self._chunk_size = chunk_size
         self._content = content
-        self._data = b''
-        self._file_descriptor = None
+        self._current = None
+        self._deadline = deadline
+        self._envelope = None
         self._info_done = 0
         self._last_closed = -1
         self._len_rest_chunk = len(self._boundary) + 16
         self._length = size or int(self.headers.get('Content-Length', '0'))
         self._attach_headers_is_parsed = False
-        self._part_data = b''
+        self._paused = False
         self._part_headers = {}
         self._part_count = 0
         self._read_bytes = 0
         self._rest = b''
+        self._spool_size = spool_size
+        self.destination = destination
+        """(function): function returning the attachments final path."""
+        self.sink = sink
+        """(function): sink factory for the attachments."""
+        self.accept = accept
+        self._writer = None
+        self._writer_queue = writer_queue
         self._callback = callback or void_callback
+        self._listening = utils.listening(self._callback)
+        self._progress = (progress or utils.Progress()).meter(self._length)
         self._split = re.compile(
-            SPLIT.replace(b'<b>', self._boundary.replace(b'"', b''))).split
+            SPLIT.replace(b'<b>', self._boundary)).split
         self.uuid = uuid.uuid4().hex
 
+    @property
+    def accept(self):
+        """(function): predicate over the headers of the attachments to keep."""
+        return self._accept
+
+    @accept.setter
+    def accept(self, accept):
+        """accept setter"""
+        self._accept = attachment_filter(accept)
+
+    def is_accepted(self, attach):
+        """Return True if the attachment passes the filter."""
+        return self._accept is None or self._accept(attach.headers)
+
+    def accepted(self):
+        """Return the attachments by id which pass the filter."""
+        if self._accept is None:
+            return self.by_id
+        return {att_id: attach for att_id, attach in self.by_id.items()
+                if self._accept(attach.headers)}
+
     def get_current_attach(self):
         """Return current attach if one"""
         try:
@@ -196,6 +521,7 @@ class MultiPartReader(object):
         """read_chunk"""
         if self._end_of_stream:
             return None
+        self._check_deadline()
         size = size or self._chunk_size
         chunk_size = min(size, self._length - self._read_bytes)
         chunk = self._content.read(chunk_size)
@@ -205,18 +531,115 @@ class MultiPartReader(object):
             self._content.close()
         return chunk
 
+    def _check_deadline(self):
+        """Raise DeadlineExceeded if the deadline is passed."""
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            self._end_of_stream = True
+            self._content.close()
+            if self._writer is not None:
+                self._writer.flush()
+            raise excs.DeadlineExceeded("Deadline exceeded reading multipart")
+
     def read_all(self, chunk_size=None):
         """read_all"""
         while not self._end_of_stream:
             self.read(chunk_size)
         return self
 
+    def _start_part(self, raw_headers):
+        """A new part begins (the first one is the JSON envelope)."""
+        headers = dict(get_headers(raw_headers))
+        self._attach_size = 0
+        if self._envelope is None and not self._info_done:
+            self._envelope = []
+            self._part_headers = headers
+            return
+        if self._accept is not None and not self._accept(CaseInsensitiveDict(
+                {k.decode(): v.decode() for k, v in headers.items()})):
+            # the part data will be skipped.
+            return
+        attach = JsonWspAttachment(
+            self._part_count, spool_size=self._spool_size, headers=headers,
+            destination=self.destination, sink=self.sink)
+        self.attachs[self._part_count] = attach
+        self._part_count += 1
+        self._current = attach
+
+    def _write_part(self, data):
+        """Write data of the current part."""
+        if not data:
+            return
+        self._attach_size += len(data)
+        if self._current is not None:
+            if self._writer_queue:
+                if self._writer is None:
+                    self._writer = AttachmentWriter(
+                        self._writer_queue, self._part_done)
+                # the data may be a view on the parser buffer.
+                self._writer.write(self._current, bytes(data))
+            else:
+                self._current.write(data)
+        elif self._envelope is not None:
+            self._envelope.append(bytes(data))
+
+    def _end_part(self):
+        """The current part is complete."""
+        if self._current is not None:
+            attach = self._current
+            attach.size = self._attach_size
+            self._current = None
+            if self._writer is not None:
+                self._writer.finish(attach)
+            else:
+                attach.finish()
+                self._part_done(attach)
+        elif self._envelope is not None:
+            self.info = json.loads(b''.join(self._envelope))
+            self.info['headers'] = self._part_headers
+            self._info_done = 1
+            self._envelope = None
+            # the rest of the chunk is parsed on the next read, so sink and
+            # accept can still be set for the first attachment.
+            self._paused = not self._end_of_stream
+
+    def _part_done(self, attach):
+        """The attachment has been completely written."""
+        if attach.att_id:
+            self.by_id[attach.att_id] = attach
+        # set the last closed index
+        self._last_closed = attach.index
+
+    def _end_stream(self):
+        """The stream is over, drop the part left incomplete (if any)."""
+        if self._writer is not None:
+            self._writer.flush()
+        if self._current is not None:
+            attach = self._current
+            attach.remove()
+            del self.attachs[attach.index]
+            self._current = None
+        self._progress_event("multipartreader.end")
+
+    def _progress_event(self, name):
+        """Trigger a progress event with throughput, ETA and the bytes of
+        the current attachment."""
+        self._callback(
+            name,
+            uuid=self.uuid,
+            value=self._read_bytes,
+            length=self._length,
+            attach=self.get_current_attach(),
+            attach_value=self._attach_size,
+            **self._progress.stats(self._read_bytes)
+        )
+
     def write(self, data, save=False):
         """Write"""
         # if attach headers is parsed.
         if not self._attach_headers_is_parsed:
             # try to get headers.
             self._attach_headers += data
+            data = b''
             has_headers = split_headers(self._attach_headers)
             if has_headers:
                 # if we found some headers, the data will be the rest of chunk.
@@ -225,45 +648,15 @@ class MultiPartReader(object):
                 self._attach_headers = self._attach_headers[:has_headers.start(
                 )]
                 self._attach_headers_is_parsed = True
+                self._start_part(self._attach_headers)
         if self._attach_headers_is_parsed:
-            self._attach_size += len(data)
-            if self._part_count == 0:
-                # if the counter is 0 we add the data for the attach and set
-                # the headers.
-                self._part_data += data
-                self._part_headers = dict(get_headers(self._attach_headers))
-            else:
-                # else let's set the info if we haven't done it yet.
-                if not self.info:
-                    self.info = json.loads(self._part_data)
-                    self.info['headers'] = self._part_headers
-                    self._info_done = 1
-                # write to the file descriptor.
-                os.write(self._file_descriptor, data)
-            # if we have to save.
+            self._write_part(data)
             if save:
-                if self._file_descriptor is not None:
-                    # if we have a descriptor, retrieve the last attachment,
-                    # update its information and close it.
-                    attach = self.attachs[self._part_count - 1]
-                    attach.update(dict(get_headers(self._attach_headers)))
-                    attach.size = self._attach_size
-                    attach.close()
-                    # set the last closed index
-                    self._last_closed = self._part_count - 1
-                    if attach.att_id:
-                        self.by_id[attach.att_id] = attach
-                if not self._attach_end_of_parts:
-                    # if we are not at the end of the parties maybe we need a
-                    # new attachment.
-                    attach = JsonWspAttachment(self._part_count)
-                    self._file_descriptor = attach.descriptor
-                    self.attachs[self._part_count] = attach
-                    self._part_count += 1
-                # reset some value.
-                self._attach_size = 0
-                self._attach_headers = b''
-                self._attach_headers_is_parsed = False
+                self._end_part()
+        if save:
+            # reset some value.
+            self._attach_headers = b''
+            self._attach_headers_is_parsed = False
 
     def read(self, chunk_size=None):
         """read"""
@@ -276,71 +669,280 @@ class MultiPartReader(object):
                 attach=self.get_current_attach(),
             )
         chunk_size = chunk_size or self._chunk_size
-        chunk = self.read_chunk(chunk_size)
-        # let's try to split the chunk using the boundary.
-        parts = self._split(self._rest + chunk)
-        # if we have more than 1 part we must handle them.
-        if len(parts) > 1:
-            # add the first part to our data.
-            self._data += parts[0]
-            # write the data and save it.
-            self.write(self._data, save=True)
-            # then write and save all the others except the last one.
-            for part in parts[1:-1]:
+        try:
+            self.feed(self.read_chunk(chunk_size))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Stop reading: the writer thread is stopped, the part left
+        incomplete is dropped and the content is closed."""
+        if self._writer is not None:
+            self._writer.stop()
+        if self._current is not None:
+            attach = self._current
+            attach.remove()
+            del self.attachs[attach.index]
+            self._current = None
+        if not self._end_of_stream:
+            self._end_of_stream = True
+            self._content.close()
+
+    def feed(self, chunk):
+        """Parse a chunk of the multipart stream (stopping after the JSON
+        envelope)."""
+        data = self._rest + chunk
+        self._paused = False
+        # split one boundary at a time until the envelope is complete.
+        while not self._info_done:
+            parts = self._split(data, 1)
+            if len(parts) == 1:
+                break
+            self.write(parts[0], save=True)
+            data = parts[1]
+        if self._paused:
+            self._rest = data
+        else:
+            # let's try to split the chunk using the boundary.
+            parts = self._split(data)
+            # if we have more than 1 part we must handle them, all but the
+            # last one are complete.
+            for part in parts[:-1]:
                 self.write(part, save=True)
-            # clean up our data.
-            self._data = b''
-        # let's write the last part for this chunk (maybe the only one)
-        # without saving it.
-        self.write(parts[-1:][0][:-self._len_rest_chunk], save=False)
-        self._callback(
-            "multipartreader.read",
-            uuid=self.uuid,
-            value=self._read_bytes,
-            length=self._length,
-            attach=self.get_current_attach(),
-        )
-        # set the attach end of part.
-        self._attach_end_of_parts = self._end_of_stream
-        # if we are at the end of the stream we save the attachment and delete
-        # the temporary file and also delete the attachment.
+            # let's write the last part for this chunk (maybe the only one)
+            # without saving it.
+            self.write(parts[-1][:-self._len_rest_chunk], save=False)
+            # our remainder should be what's left of the last chunk.
+            self._rest = parts[-1][-self._len_rest_chunk:]
+        if (self._listening("multipartreader.read") and
+                self._progress.due(self._read_bytes)):
+            self._progress_event("multipartreader.read")
         if self._end_of_stream:
-            if self._file_descriptor:
-                attach = self.attachs[self._part_count - 1]
-                attach.close()
-                os.remove(attach.path)
-                del attach
-            self._callback(
-                "multipartreader.end",
-                uuid=self.uuid,
-                value=self._read_bytes,
-                length=self._length,
-                attach=self.get_current_attach(),
-            )
-        # our remainder should be what's left of the last chunk.
-        self._rest = parts[-1:][0][-self._len_rest_chunk:]
+            self._end_stream()
 
     def iterator(self, chunk_size=None):
-        """Iterator"""
+        """Iterator (an iterator closed before the end closes the reader)."""
         last_closed = self._last_closed
-        while not self._end_of_stream:
-            self.read(chunk_size)
-            if self._info_done == 1:
-                yield self.info
-                self._info_done = 2
-            if last_closed != self._last_closed:
-                yield self.attachs[self._last_closed]
-                last_closed = self._last_closed
-        if last_closed != self._last_closed:
-            yield self.attachs[self._last_closed]
-            last_closed = self._last_closed
+        try:
+            while not self._end_of_stream:
+                self.read(chunk_size)
+                if self._info_done == 1:
+                    yield self.info
+                    self._info_done = 2
+                # a single chunk can close more than one attachment.
+                while last_closed < self._last_closed:
+                    last_closed += 1
+                    if self.is_accepted(self.attachs[last_closed]):
+                        yield self.attachs[last_closed]
+        finally:
+            self.close()
+
+
+class BufferedMultiPartReader(MultiPartReader):
+    """Incremental reader.
+
+    Same results of :class:`MultiPartReader` but the stream is parsed by a
+    state machine on a reusable ``bytearray``: boundaries are searched only
+    in the new data and the parts data are written as ``memoryview``
+    slices, without splitting or concatenating bytes.
+    """
+
+    PREAMBLE, HEADERS, BODY, EPILOGUE = range(4)
+
+    def __init__(self, *args, **kwargs):
+        super(BufferedMultiPartReader, self).__init__(*args, **kwargs)
+        self._buffer = bytearray()
+        self._state = self.PREAMBLE
+        self._scan = 0
+        self._dash_boundary = b'--' + self._boundary
+        self._delimiter = b'\n' + self._dash_boundary
+
+    def feed(self, chunk):
+        """Parse a chunk of the multipart stream."""
+        self._buffer += chunk
+        self._paused = False
+        pos = 0
+        while (pos is not None and self._state != self.EPILOGUE and
+               not self._paused):
+            if self._state == self.BODY:
+                pos = self._feed_body(pos)
+            elif self._state == self.HEADERS:
+                pos = self._feed_headers(pos)
+            else:
+                pos = self._feed_preamble(pos)
+        if self._state == self.EPILOGUE:
+            self._buffer = bytearray()
+        elif self._scan:
+            # keep only what we haven't consumed yet.
+            self._buffer = self._buffer[self._scan:]
+            self._scan = 0
+        if (self._listening("multipartreader.read") and
+                self._progress.due(self._read_bytes)):
+            self._progress_event("multipartreader.read")
+        if self._end_of_stream:
+            self._end_stream()
+
+    def _after_boundary(self, pos):
+        """Check what follows a boundary at pos.
+
+        Returns:
+            tuple: next state and position after the boundary line, or
+                (None, None) if more data are needed, or (False, None) if
+                it isn't a boundary.
+        """
+        tail = self._buffer[pos:pos + 2]
+        if len(tail) < 2 and not self._end_of_stream:
+            return None, None
+        if tail == b'--':
+            return self.EPILOGUE, pos + 2
+        if tail == b'\r\n':
+            return self.HEADERS, pos + 2
+        if tail[:1] == b'\n':
+            return self.HEADERS, pos + 1
+        return False, None
+
+    def _feed_preamble(self, pos):
+        """Skip everything before the first boundary."""
+        buffer = self._buffer
+        while True:
+            idx = buffer.find(self._dash_boundary, pos)
+            if idx < 0:
+                self._scan = max(
+                    self._scan, len(buffer) - len(self._dash_boundary) - 2)
+                return None
+            if idx == 0 or buffer[idx - 1] == 10:
+                state, end = self._after_boundary(idx + len(self._dash_boundary))
+                if state is None:
+                    self._scan = idx
+                    return None
+                if state is not False:
+                    self._state = state
+                    self._scan = end
+                    return end
+            pos = idx + 1
+
+    def _feed_headers(self, pos):
+        """Wait for the whole part headers."""
+        buffer = self._buffer
+        ends = [(idx, idx + len(sep)) for idx, sep in (
+            (buffer.find(b'\n\n', pos), b'\n\n'),
+            (buffer.find(b'\r\n\r\n', pos), b'\r\n\r\n')) if idx >= 0]
+        if not ends:
+            self._scan = pos
+            return None
+        start, end = min(ends)
+        self._start_part(bytes(buffer[pos:start]))
+        self._state = self.BODY
+        self._scan = end
+        return end
+
+    def _feed_body(self, pos):
+        """Write the part data until the next boundary."""
+        buffer = self._buffer
+        search = pos
+        while True:
+            idx = buffer.find(self._delimiter, search)
+            if idx < 0:
+                # write all but what could be the beginning of a delimiter.
+                safe = max(pos, len(buffer) - len(self._delimiter) - 1)
+                if safe > pos:
+                    with memoryview(buffer) as view:
+                        self._write_part(view[pos:safe])
+                self._scan = safe
+                return None
+            state, end = self._after_boundary(idx + len(self._delimiter))
+            if state is None:
+                if idx > pos:
+                    data_end = idx - 1 if buffer[idx - 1] == 13 else idx
+                    with memoryview(buffer) as view:
+                        self._write_part(view[pos:data_end])
+                    pos = data_end
+                self._scan = pos
+                return None
+            if state is not False:
+                data_end = idx - 1 if idx > pos and buffer[idx - 1] == 13 else idx
+                if data_end > pos:
+                    with memoryview(buffer) as view:
+                        self._write_part(view[pos:data_end])
+                self._end_part()
+                self._state = state
+                self._scan = end
+                return end
+            search = idx + 1
+
+
+READERS = {
+    'regex': MultiPartReader,
+    'buffer': BufferedMultiPartReader,
+}
+"""(dict): multipart reader engines by name."""
+
+DEFAULT_ENGINE = 'buffer'
+"""(str): default multipart reader engine."""
+
+
+class IterStream(object):
+    """File-like object reading the chunks of an iterable.
+
+    Args:
+        iterable (iterable): iterable of bytes chunks.
+    """
+
+    def __init__(self, iterable):
+        self._iter = iter(iterable)
+        self._chunk = b''
+
+    def read(self, size=-1):
+        """Read at most size bytes (a chunk if size is negative)."""
+        while not self._chunk:
+            self._chunk = next(self._iter, None)
+            if self._chunk is None:
+                self._chunk = b''
+                return b''
+        if size is None or size < 0 or size >= len(self._chunk):
+            data, self._chunk = self._chunk, b''
+        else:
+            data, self._chunk = self._chunk[:size], self._chunk[size:]
+        return data
+
+    def close(self):
+        """Close the iterable (if it can be closed)."""
+        close = getattr(self._iter, 'close', None)
+        if close is not None:
+            close()
+
+
+def get_size(fobj):
+    """Return the size of a seekable file object (None if unknown)."""
+    try:
+        fobj.seek(0, os.SEEK_END)
+        size = fobj.tell()
+        fobj.seek(0)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return size
 
 
 class MultiPartWriter(object):
 
-    """MultiPartWriter"""
+    """MultiPartWriter
 
-    def __init__(self, jsonpart, files, chunk_size=8192, boundary=None, encoding='UTF-8'):
+    Attachments can be buffers (bytes, bytearray, memoryview, mmap...), sent
+    as memoryview slices without copying them, file objects or iterables of
+    bytes (like generators), the length of the multipart is None if some of
+    them is not seekable.
+
+    Args:
+        jsonpart (dict): JSON data.
+        files (dict): attachments by id.
+        callback (function, optional): events trigger.
+        progress (Progress, optional): throttling policy of the
+            ``multipartwriter.part.write`` events.
+    """
+
+    def __init__(self, jsonpart, files, chunk_size=8192, boundary=None, encoding='UTF-8',
+                 callback=None, progress=None):
         self._chunk_size = chunk_size
         self._enc = encoding
         self._boundary = (
@@ -348,28 +950,47 @@ class MultiPartWriter(object):
         ).encode(encoding)
         self._jsonpart = jsonpart
         self._bound = b'\n--%s' % self._boundary
-        self._files = files
-        self._length = self._get_length()
+        self._callback = callback or void_callback
+        self._listening = utils.listening(self._callback)
+        self._progress = progress or utils.Progress()
+        self._files = {
+            fileid: self._get_source(fobj)
+            for fileid, fobj in list(files.items())}
+        self._sizes = {
+            fileid: fobj.nbytes if isinstance(fobj, memoryview) else get_size(fobj)
+            for fileid, fobj in self._files.items()}
+        self.length = self._get_length()
+        """(int): multipart length (None if unknown)."""
         self._iter = None
+        self.uuid = uuid.uuid4().hex
         self.headers = {
             "Content-type": b'multipart/related; boundary=' + self._boundary,
             "Accept": b'application/json,multipart/related',
         }
 
+    @staticmethod
+    def _get_source(fobj):
+        """Return a memoryview for buffers or a file-like object."""
+        if utils.is_buffer(fobj):
+            return memoryview(fobj).cast('B')
+        if hasattr(fobj, 'read'):
+            return fobj
+        return IterStream(fobj)
+
     def _get_length(self):
         """Get Length"""
+        if None in self._sizes.values():
+            return None
         length = len(self._get_multipart())
         length += len(self._get_jsonpart())
-        for fileid, fobj in list(self._files.items()):
+        for fileid in self._files:
             length += len(self._get_attachpart(fileid))
-            fobj.seek(0, os.SEEK_END)
-            length += fobj.tell() + len(self._bound)
-            fobj.seek(0)
+            length += self._sizes[fileid] + len(self._bound)
         length += len(b'--')
         return length
 
     def __len__(self):
-        return self._length
+        return self.length or 0
 
     def _get_multipart(self):
         return b"--" + self._boundary + b"\n"
@@ -389,6 +1010,17 @@ class MultiPartWriter(object):
             'Content-ID': fileid
         })
 
+    def _part_event(self, name, fileid, value, progress):
+        """Trigger a part event."""
+        self._callback(
+            "multipartwriter.part." + name,
+            uuid=self.uuid,
+            att_id=fileid,
+            value=value,
+            length=self._sizes[fileid],
+            **progress.stats(value)
+        )
+
     def _iterator(self, chunk_size=None):
         """iteratore"""
         chunk_size = chunk_size or self._chunk_size
@@ -399,11 +1031,22 @@ class MultiPartWriter(object):
         for fileid, fobj in list(self._files.items()):
             part = self._get_attachpart(fileid)
             yield part
+            written = 0
+            progress = self._progress.meter(self._sizes[fileid])
+            self._part_event('start', fileid, written, progress)
             while True:
-                chunk = fobj.read(chunk_size)
+                if isinstance(fobj, memoryview):
+                    chunk = fobj[written:written + chunk_size]
+                else:
+                    chunk = fobj.read(chunk_size)
                 if not chunk:
+                    self._part_event('end', fileid, written, progress)
                     yield self._bound
                     break
+                written += len(chunk)
+                if (self._listening('multipartwriter.part.write') and
+                        progress.due(written)):
+                    self._part_event('write', fileid, written, progress)
                 yield chunk
         yield b'--'
 
@@ -417,9 +1060,6 @@ class MultiPartWriter(object):
         except StopIteration:
             return None
 
-    def __next__(self):
-        return next(self)
-
     def __next__(self):
         """Next"""
         if self._iter is None:
@@ -433,8 +1073,15 @@ class MultiPartWriter(object):
         return self
 
     def close(self):
-        """Close"""
-        pass
+        """Close the iterables attachments and release the buffers."""
+        if self._iter is not None:
+            self._iter.close()
+        for fobj in self._files.values():
+            if isinstance(fobj, IterStream):
+                fobj.close()
+            elif isinstance(fobj, memoryview):
+                fobj.release()
+        self._files = {}
 
 
 JSONTYPES = {
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+============================================
+Jsonwsppool :mod:`jsonwspclient.jsonwsppool`
+============================================
+
+"""
+import logging
+import queue
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import FullPoolError
+
+log = logging.getLogger('jsonwspclient')
+
+
+class PoolStats:
+    """Connections pool statistics.
+
+    Attributes:
+
+        active (int): connections in use.
+        idle (int): connections waiting in the pool.
+        created (int): connections created.
+        discarded (int): connections closed because the pool was full
+            or because they were idle for too long.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.idle = 0
+        self.created = 0
+        self.discarded = 0
+
+    def update(self, **deltas):
+        """Update the counters."""
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def as_dict(self):
+        """Return the counters as a dictionary."""
+        with self._lock:
+            return dict(
+                active=self.active, idle=self.idle, created=self.created,
+                discarded=self.discarded)
+
+
+class _PoolMixin:
+    """Connection pool which updates the adapter stats and reaps the
+    connections idle for too long every time the pool is used."""
+
+    _stats = None
+    _idle_timeout = None
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        self._stats.update(created=1)
+        return conn
+
+    def _reap(self):
+        """Close the connections idle for too long, their pool slots are
+        left empty so new connections can be created."""
+        pool = self.pool
+        if self._idle_timeout is None or pool is None:
+            return
+        expired = []
+        now = time.monotonic()
+        with pool.mutex:
+            for idx, conn in enumerate(pool.queue):
+                idle_since = getattr(conn, '_jsonwsp_idle_since', None)
+                if (idle_since is not None and
+                        now - idle_since >= self._idle_timeout):
+                    conn._jsonwsp_idle_since = None
+                    pool.queue[idx] = None
+                    expired.append(conn)
+        for conn in expired:
+            conn.close()
+        if expired:
+            self._stats.update(idle=-len(expired), discarded=len(expired))
+
+    def _get_conn(self, timeout=None):
+        self._reap()
+        conn = super()._get_conn(timeout)
+        idle_since = getattr(conn, '_jsonwsp_idle_since', None)
+        if idle_since is None:
+            self._stats.update(active=1)
+            return conn
+        conn._jsonwsp_idle_since = None
+        if (self._idle_timeout is not None and
+                time.monotonic() - idle_since >= self._idle_timeout):
+            # the connection will reconnect on use.
+            conn.close()
+            self._stats.update(active=1, idle=-1, discarded=1, created=1)
+        else:
+            self._stats.update(active=1, idle=-1)
+        return conn
+
+    def _put_conn(self, conn):
+        self._stats.update(active=-1)
+        if conn is None or self.pool is None:
+            return super()._put_conn(conn)
+        self._reap()
+        conn._jsonwsp_idle_since = time.monotonic()
+        self._stats.update(idle=1)
+        try:
+            self.pool.put(conn, block=False)
+            return None
+        except AttributeError:
+            # the pool has been closed meanwhile.
+            self._stats.update(idle=-1)
+            return super()._put_conn(conn)
+        except queue.Full:
+            conn._jsonwsp_idle_since = None
+            conn.close()
+            self._stats.update(idle=-1, discarded=1)
+            if self.block:
+                raise FullPoolError(
+                    self,
+                    "Pool reached maximum size and no more connections are allowed.",
+                ) from None
+            log.warning(
+                "Connection pool is full, discarding connection: %s", self.host)
+        return None
+
+
+class PoolingAdapter(HTTPAdapter):
+    """HTTPAdapter with connections statistics and idle connections reaping.
+
+    Args:
+        idle_timeout (int, float, optional): seconds after which an idle
+            connection is closed instead of being reused.
+        **kwargs: `HTTPAdapter <https://requests.readthedocs.io/en/latest/api/#requests.adapters.HTTPAdapter>`_
+            arguments (``pool_connections``, ``pool_maxsize``, ``pool_block``, ...).
+    """
+
+    def __init__(self, idle_timeout=None, **kwargs):
+        self.idle_timeout = idle_timeout
+        """(int, float): seconds after which an idle connection is closed."""
+        self.stats = PoolStats()
+        """(PoolStats): connections statistics."""
+        super().__init__(**kwargs)
+
+    def reap(self):
+        """Close the connections idle for too long in all the pools."""
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if isinstance(pool, _PoolMixin):
+                pool._reap()
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Initialize the pool manager with our pool classes."""
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {'_stats': self.stats, '_idle_timeout': self.idle_timeout}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type(
+                'HTTPConnectionPool', (_PoolMixin, HTTPConnectionPool), attrs),
+            'https': type(
+                'HTTPSConnectionPool', (_PoolMixin, HTTPSConnectionPool), attrs),
+        }
@@ -4,11 +4,13 @@
 Jsonwspresponse :mod:`jsonwspclient.jsonwspresponse`
 ====================================================
 """
+import copy
 import logging
+import os
 
 from . import jsonwspexceptions as excs
 from . import jsonwsputils as utils
-from .jsonwspmultipart import MultiPartReader
+from .jsonwspmultipart import DEFAULT_ENGINE, READERS
 
 log = logging.getLogger('jsonwspclient')
 
@@ -18,10 +20,17 @@ class JsonWspResponse:
     .python-requests.org/en/master/api/#requests.Response>`_) is not meant
     to be instantiate manually but only as response from :any:`JsonWspClient`
     requests.
+
+    Args:
+        response (requests.Response): the response to wrap.
+        trigger (function): events trigger.
+        **reader_options: :class:`MultiPartReader` options for multipart
+            responses (``engine`` selects the reader in :data:`READERS`).
     """
 
-    def __init__(self, response, trigger):
+    def __init__(self, response, trigger, **reader_options):
         self._response = response
+        self._reader_options = reader_options
         self.__reader = None
         self._boundary = utils.get_boundary(self.headers)
         self._multipart = None
@@ -65,6 +74,26 @@ class JsonWspResponse:
         self._check_fault()
         self._get_attchments_id()
 
+    def copy(self):
+        """Return a copy of the response which doesn't share its JSON data.
+
+        Returns:
+            JsonWspResponse: the copy.
+
+        Raises:
+            TypeError: if the response is multipart.
+        """
+        if self.is_multipart:
+            raise TypeError("A multipart response can't be copied")
+        clone = object.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.response_dict = copy.deepcopy(self.response_dict)
+        clone.attachments = {}
+        clone.fault = {}
+        clone.result = {}
+        clone._check_fault()
+        return clone
+
     def _check_fault(self):
         """Check fault."""
         self.has_fault = self.response_dict.get('type') == "jsonwsp/fault"
@@ -81,13 +110,20 @@ class JsonWspResponse:
 
     def _get_reader(self):
         """get all."""
-        self._multipart = MultiPartReader(
-            self.headers,
-            utils.FileWithCallBack(self.raw, self._trigger, size=self.length),
-            size=self.length,
-            callback=self._trigger)
+        self._multipart = self._new_reader(
+            utils.FileWithCallBack(
+                self.raw, self._trigger, size=self.length,
+                progress=self._reader_options.get('progress')))
         return self._multipart.iterator()
 
+    def _new_reader(self, content, readers=READERS):
+        """Return the multipart reader of the selected engine."""
+        options = dict(self._reader_options)
+        engine = options.pop('engine', None) or DEFAULT_ENGINE
+        return readers[engine](
+            self.headers, content, size=self.length, callback=self._trigger,
+            **options)
+
     @property
     def _reader(self):
         if not self.is_multipart:
@@ -96,17 +132,39 @@ class JsonWspResponse:
             raise IOError("Reader is None")
         return self.__reader
 
-    def read_all(self, chunk_size=None):
+    def read_all(self, chunk_size=None, sink=None, accept=None):
         """Read all the data and return a Dictionary containig the Attachments.
 
         Args:
             chunk_size (int): bytes to read each time.
+            sink (function, optional): sink factory for the attachments not
+                yet read, it receives the attachment id and headers and
+                returns a writable for the attachment data.
+            accept (set, function, optional): content ids of the attachments
+                to keep or a predicate over their headers.
 
         Returns:
             dict: Dictionary with all attachments.
         """
+        if sink is not None:
+            self._multipart.sink = sink
+        if accept is not None:
+            self._multipart.accept = accept
         self._multipart.read_all(chunk_size)
-        return self._multipart.by_id
+        return self._multipart.accepted()
+
+    def iter_attachments(self, accept=None):
+        """Iterate over the attachments not yet read (with ``for`` or
+        ``async for``) keeping only the accepted ones.
+
+        Args:
+            accept (set, function, optional): content ids of the attachments
+                to keep or a predicate over their headers, the other parts
+                are skipped without writing them.
+        """
+        if accept is not None:
+            self._multipart.accept = accept
+        return self
 
     def __next__(self):
         """If JsonWspResponse is multipart returns the next attachment.
@@ -116,7 +174,8 @@ class JsonWspResponse:
         """
         return next(self._reader)
 
-    def save_all(self, path, name='name', overwrite=True):
+    def save_all(self, path, name='name', overwrite=True, direct=False,
+                 accept=None):
         """Save all the attachments ad once.
 
         Args:
@@ -124,15 +183,50 @@ class JsonWspResponse:
             name (str, optional): key with which the file name is specified in the
                 dictionary (default ``name``).
             overwrite (bool, optional): overwrite the file if exists (defautl True).
+            direct (bool, optional): write the attachments not yet read
+                directly to their destination, through a ``.partial`` file
+                renamed once complete (default False).
+            accept (set, function, optional): content ids of the attachments
+                to save or a predicate over their headers.
         """
+        self._prepare_save(path, name, overwrite, direct, accept)
         for attach in self._reader:
             if not attach:
                 break
+            self._save_attach(attach, path, name, overwrite)
+
+    def _attach_filename(self, attach, name):
+        """Return the file name of the attachment."""
+        try:
+            return self.attachments[attach.att_id][name]
+        except KeyError:
+            return attach.headers.get("x-filename")
+
+    def _prepare_save(self, path, name, overwrite, direct, accept):
+        """Set the reader filter and destination for the save."""
+        if accept is not None:
+            self._multipart.accept = accept
+        if not direct:
+            return
+
+        def destination(attach):
+            """Return the final path of the attachment (if any)."""
             try:
-                filename = self.attachments[attach.att_id][name]
-            except KeyError:
-                filename = attach.headers.get("x-filename")
-            attach.save(path, filename=filename, overwrite=overwrite)
+                target = attach.target_path(
+                    path, self._attach_filename(attach, name))
+            except ValueError:
+                return None
+            if overwrite is False and os.path.exists(target):
+                return None
+            return target
+        self._multipart.destination = destination
+
+    def _save_attach(self, attach, path, name, overwrite):
+        """Move the attachment to path (if not already there)."""
+        if attach.target is None and attach.sink is None:
+            attach.move(
+                path, filename=self._attach_filename(attach, name),
+                overwrite=overwrite)
 
     def raise_for_fault(self):
         """Reise error if needed else return self."""
@@ -144,6 +238,12 @@ class JsonWspResponse:
             raise excs.IncompatibleFault(response=self)
         return self
 
+    def close(self):
+        """Close the response (and stop its multipart reader)."""
+        if self._multipart is not None:
+            self._multipart.close()
+        self._response.close()
+
     def __iter__(self):
         return self
 
@@ -154,6 +254,9 @@ class JsonWspResponse:
         self.close()
 
     def __del__(self):
+        multipart = self.__dict__.get('_multipart')
+        if multipart is not None:
+            multipart.close()
         del self.__reader
         del self._multipart
         del self.attachments
@@ -6,25 +6,166 @@ Jsonwspservice :mod:`jsonwspclient.jsonwspservice`
 
 """
 # pylint: disable=relative-import
+import functools
+import json
+import keyword
 import logging
+import threading
+import time
+import weakref
+from hashlib import md5
 
 import requests
 
 from . import jsonwspexceptions as excs
 from . import jsonwsputils as utils
+from .jsonwspcache import ResponseCache
 from .jsonwspmultipart import JSONTYPES
 
 log = logging.getLogger('jsonwspclient')
 
 
+class CallPlan(object):
+    """Precompiled call of a service method.
+
+    Args:
+        params ([str]): method params.
+        mandatory ([str]): mandatory params.
+        optional ([str]): optional params.
+        mapped ([(str, function)]): mapped params with the functions which
+            return their values.
+        version (int): version of the params mapping (None if unknown).
+    """
+
+    __slots__ = ('params', 'mandatory', 'optional', 'mapped', 'version')
+
+    def __init__(self, params, mandatory, optional, mapped, version):
+        self.params = frozenset(params)
+        self.mandatory = frozenset(mandatory)
+        self.optional = tuple(optional)
+        self.mapped = tuple(mapped)
+        self.version = version
+
+
+class _Default(object):
+    """Default of the generated methods params (shown by help)."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __repr__(self):
+        return self._name
+
+
+_REQUIRED = _Default('<required>')
+_OPTIONAL = _Default('<optional>')
+_classes = weakref.WeakValueDictionary()
+_classes_lock = threading.Lock()
+
+
+def _method_doc(info):
+    """Docstring of a generated method."""
+    lines = [line.strip() for line in info['doc_lines']] or [
+        '{} service method.'.format(info['method_name'])]
+    if info['params_order']:
+        lines += ['', 'Args:']
+        for pname in info['params_order']:
+            pinfo = info['params_info'][pname]
+            lines.append('    {} ({}{}): {}'.format(
+                pname, pinfo.get('type'),
+                ', optional' if pinfo.get('optional') else '',
+                ' '.join(pinfo.get('doc_lines') or [])).rstrip())
+    return '\n'.join(lines)
+
+
+def _make_function(info, qualname, module):
+    """Generate the function of a service method.
+
+    The method params are keyword only arguments (the mandatory ones can
+    still come from the params mapping), anything else (``mirror``,
+    ``timeout``, ...) goes in ``**kwargs``.
+    """
+    params = [
+        pname for pname in info['params_order']
+        if pname.isidentifier() and not keyword.iskeyword(pname) and
+        pname not in ('self', 'kwargs')]
+    args = ''.join(', {}={}'.format(
+        pname, '_REQUIRED' if pname in info['mandatory'] else '_OPTIONAL')
+        for pname in params)
+    body = ''.join(
+        '    if {0} is not {1}:\n        kwargs[{0!r}] = {0}\n'.format(
+            pname, '_REQUIRED' if pname in info['mandatory'] else '_OPTIONAL')
+        for pname in params)
+    source = 'def method(self{}{}, **kwargs):\n{}    return self._call({!r}, kwargs)\n'.format(
+        ', *' if params else '', args, body, info['method_name'])
+    namespace = {'_REQUIRED': _REQUIRED, '_OPTIONAL': _OPTIONAL}
+    exec(compile(source, '<{}>'.format(qualname), 'exec'), namespace)
+    funct = namespace['method']
+    funct.__name__ = info['method_name']
+    funct.__qualname__ = qualname
+    funct.__module__ = module
+    funct.__doc__ = _method_doc(info)
+    funct.info = info
+    funct.__dict__.update(info)
+    return funct
+
+
+def service_class(base, name, methods_info):
+    """Return the class of a service with a real method per service method.
+
+    Classes are cached while in use, so clients loading the same
+    description share them.
+
+    Args:
+        base (type): service base class.
+        name (str): service name.
+        methods_info (dict): methods info by method name.
+
+    Returns:
+        type: subclass of base.
+    """
+    key = (base, name, md5(json.dumps(
+        methods_info, sort_keys=True, default=repr).encode('UTF-8')).hexdigest())
+    cls = _classes.get(key)
+    if cls is not None:
+        return cls
+    with _classes_lock:
+        cls = _classes.get(key)
+        if cls is None:
+            clsname = name if name.isidentifier() else base.__name__
+            functions = {
+                method_name: _make_function(
+                    info, '{}.{}'.format(clsname, method_name), base.__module__)
+                for method_name, info in methods_info.items()}
+            namespace = {
+                method_name: funct for method_name, funct in functions.items()
+                if method_name.isidentifier() and
+                not method_name.startswith('_') and
+                not hasattr(base, method_name)}
+            namespace.update(
+                _functions=functions, _service_base=base,
+                __module__=base.__module__,
+                __doc__='{} service.'.format(name))
+            cls = _classes[key] = type(clsname, (base,), namespace)
+    return cls
+
+
 class JsonWspService(object):
-    """Service."""
+    """Service.
+
+    Once the description is loaded the service becomes an instance of a
+    class generated for the description (see :func:`service_class`).
+    """
+
+    _functions = {}
+    _service_base = None
 
     def __init__(self, client, service_name):
         self.name = service_name
         self._client = client
         self._description_loaded = False
         self._methods = {}
+        self._plans = {}
         self._post = client.post
         self._post_mp = client.post_mp
         self._trigger = client.trigger
@@ -38,45 +179,114 @@ class JsonWspService(object):
         if not name.startswith('_'):
             return self._methods[name]
 
-    def _set_new_method(self, method_name, params):
+    def _set_new_method(self, method_name):
         """Set new method per service."""
-
-        def placeholder(self, **kwargs):
-            """placeholder."""
-            for param in [p for p in params if p in self._client.params_mapping]:
-                item = self._client.params_mapping[param]
-                if isinstance(item, str):
-                    try:
-                        # we use __getattribute__ or it will search the services
-                        # methods too.
-                        item = object.__getattribute__(self._client, item)
-                    except AttributeError:
-                        pass
-                if callable(item):
-                    kwargs[param] = item(method_name=method_name, **kwargs)
-                else:
-                    kwargs[param] = item
-                log.debug("Param %s: %s", param, kwargs[param])
-            return self._call_method(method_name, **kwargs)
         self._methods[method_name] = utils.make_method(
-            placeholder, self, self.__class__)
-        self._methods[method_name].__dict__[
-            'info'] = self._method_info(method_name)
-        self._methods[method_name].__dict__.update(
-            self._methods[method_name].__dict__['info'])
+            self._functions[method_name], self, self.__class__)
+        self._plans[method_name] = self._build_plan(method_name)
+
+    def _call(self, method_name, kwargs):
+        """Call the method adding the mapped params."""
+        for param, resolve in self._plan(method_name).mapped:
+            kwargs[param] = resolve(method_name, kwargs)
+            log.debug("Param %s: %s", param, kwargs[param])
+        return self._call_method(method_name, **kwargs)
+
+    def _build_plan(self, method_name):
+        """Build the call plan of the method for the current params mapping."""
+        info = self._methods[method_name].info
+        mapping = self._client.params_mapping
+        return CallPlan(
+            info['params_order'], info['mandatory'], info['optional'],
+            [(param, self._resolver(mapping[param]))
+             for param in info['params_order'] if param in mapping],
+            getattr(mapping, 'version', None))
+
+    def _plan(self, method_name):
+        """Return the call plan of the method (rebuilt if the params
+        mapping has changed)."""
+        plan = self._plans[method_name]
+        version = getattr(self._client.params_mapping, 'version', None)
+        if version is None or version != plan.version:
+            plan = self._plans[method_name] = self._build_plan(method_name)
+        return plan
+
+    def _resolver(self, item):
+        """Return the function which gives the value of a mapped param."""
+        if isinstance(item, str):
+            # we use __getattribute__ or it will search (and load) the
+            # services too.
+            getter = functools.partial(
+                object.__getattribute__, self._client, item)
+
+            def resolve(method_name, kwargs):
+                """Client attribute (or method) value."""
+                try:
+                    value = getter()
+                except AttributeError:
+                    return item
+                if isinstance(getattr(value, '__self__', None), JsonWspService):
+                    # services methods are not client attributes.
+                    return item
+                if callable(value):
+                    return value(method_name=method_name, **kwargs)
+                return value
+        elif callable(item):
+            def resolve(method_name, kwargs):
+                """Function value."""
+                return item(method_name=method_name, **kwargs)
+        else:
+            def resolve(_method_name, _kwargs):
+                """Constant value."""
+                return item
+        return resolve
 
     def _load_description(self):
         """Loads description for this service."""
+        entry = self._cached_description()
+        if entry and self._client.description_cache.is_fresh(entry):
+            self._set_description(entry['description'])
+            return
         response = self._post(
-            '/{}/jsonwsp/description'.format(self.name), method='GET')
+            '/{}/jsonwsp/description'.format(self.name), method='GET',
+            headers=self._client.description_cache.validators(entry)
+            if entry else None)
+        self._set_description(self._description_from(response, entry))
+
+    def _cached_description(self):
+        """Return the cached description entry if any."""
+        if self._client.description_cache is None:
+            return None
+        return self._client.description_cache.get(self._client.url, self.name)
+
+    def _description_from(self, response, entry):
+        """Return the description from response updating the cache."""
+        cache = self._client.description_cache
+        status = getattr(response, 'status_code', None) or response.status
+        if entry and status == 304:
+            cache.touch(self._client.url, self.name, entry)
+            return entry['description']
         response.raise_for_status()
-        self._description = response.response_dict
+        if cache is not None:
+            cache.set(
+                self._client.url, self.name, response.response_dict,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'))
+        return response.response_dict
+
+    def _set_description(self, description):
+        """Set the description and build the service methods."""
+        self._description = description
         self._method_names = list(self._description['methods'])
         self._types = list(self._description['types'])
         self.url = '/%s/jsonwsp' % self.name
-        for method_name, method in self._description['methods'].items():
-            params = list(method['params'])
-            self._set_new_method(method_name, params)
+        self.__class__ = service_class(
+            self._service_base or self.__class__, self.name,
+            {method_name: self._method_info(method_name)
+             for method_name in self._method_names})
+        self._methods = {}
+        for method_name in self._method_names:
+            self._set_new_method(method_name)
         self._description_loaded = True
         self._trigger('service.description_loaded', service=self)
 
@@ -133,16 +343,15 @@ class JsonWspService(object):
                     'Invalid param type "{}" "{}"'.format(name, ptype))
             inside_ckeck(cls)
 
-    def _call_method(self, method_name, **kwargs):
-        """Call method."""
+    def _prepare_call(self, method_name, kwargs):
+        """Check params and build the request data for a method call."""
         attachment_map = {'cid_seq': 1, 'files': {}}
         utils.walk_args_dict(kwargs, attachment_map)
-        if self._description_loaded:
-            if not set(self._methods[method_name].mandatory).issubset(kwargs):
+        plan = self._plans.get(method_name)
+        if self._description_loaded and plan is not None:
+            if not plan.mandatory.issubset(kwargs):
                 raise excs.ParamsError("Missing parameters: {}".format(
-                    ", ".join(
-                        set(self._methods[method_name].mandatory) - set(kwargs))
-                ))
+                    ", ".join(plan.mandatory - set(kwargs))))
             # TODO: need a better check params method. (disabled for now)
             # for par, info in self._methods[method_name].info['params_info'].items():
             #     self._check_param(par, kwargs[par], info['type'])
@@ -152,25 +361,106 @@ class JsonWspService(object):
             data['mirror'] = kwargs.pop('mirror')
         raise_for_fault = kwargs.pop(
             'raise_for_fault', self._client._raise_for_fault)
+        # timeout and deadline are ours unless the method has such params.
+        params = plan.params if plan is not None else ()
+        post_options = {}
+        timeout = self._client.method_timeouts.get(method_name)
+        if 'timeout' in kwargs and 'timeout' not in params:
+            timeout = kwargs.pop('timeout')
+        if timeout is not None:
+            post_options['timeout'] = timeout
+        if 'deadline' in kwargs and 'deadline' not in params:
+            deadline = kwargs.pop('deadline')
+            if deadline is not None:
+                post_options['deadline'] = time.monotonic() + deadline
+        return data, attachment_map, raise_for_fault, post_options
+
+    def _process_response(self, response, method_name, raise_for_fault, **kwargs):
+        """Apply the client processors and check the response."""
+        for processor in self._client.processors:
+            try:
+                response = processor(
+                    response, service=self, client=self._client,
+                    method_name=method_name, **kwargs)
+            except Exception:
+                pass
+        response.raise_for_status()
+        if raise_for_fault:
+            response.raise_for_fault()
+        return response
+
+    def _send_call(self, method_name, data, attachment_map, post_options):
+        """Send the call (or get it from the client response cache)."""
+        if attachment_map['files']:
+            try:
+                return self._post_mp(
+                    self.url, data, attachment_map['files'], **post_options)
+            finally:
+                utils.close_opened(attachment_map)
+        cache = self._client.response_cache
+        if cache is not None and method_name not in self._client.cache_methods:
+            cache = None
+        flight = self._client.single_flight
+        if flight is not None and 'mirror' in data:
+            flight = None
+        if cache is None and flight is None:
+            return self._post(self.url, data, **post_options)
+        key = ResponseCache.key(self.name, data)
+        if cache is not None:
+            response = cache.get(key)
+            if response is not None:
+                self._trigger(
+                    'service.cache.hit', service=self, method=method_name)
+                self._client.last_response = response
+                return response
+            self._trigger(
+                'service.cache.miss', service=self, method=method_name)
+        if flight is not None:
+            response = self._coalesced_post(
+                flight, key, method_name, data, post_options)
+        else:
+            response = self._post(self.url, data, **post_options)
+        if cache is not None and response.ok and \
+                not response.is_multipart and not response.has_fault:
+            cache.set(key, response)
+        return response
+
+    def _coalesced_post(self, flight, key, method_name, data, post_options):
+        """Post sharing the response with identical concurrent calls."""
+        def fetch():
+            """Post and keep a pristine copy for the other callers."""
+            response = self._post(self.url, data, **post_options)
+            return response, None if response.is_multipart else response.copy()
+
+        wait = None
+        if 'deadline' in post_options:
+            wait = max(0, post_options['deadline'] - time.monotonic())
+        try:
+            (response, pristine), shared = flight.do(key, fetch, wait)
+        except TimeoutError:
+            raise excs.DeadlineExceeded("Deadline exceeded")
+        if not shared:
+            return response
+        self._trigger('service.coalesced', service=self, method=method_name)
+        if pristine is None:
+            # multipart streams can be read only once.
+            return self._post(self.url, data, **post_options)
+        response = pristine.copy()
+        self._client.last_response = response
+        return response
+
+    def _call_method(self, method_name, **kwargs):
+        """Call method."""
+        data, attachment_map, raise_for_fault, post_options = \
+            self._prepare_call(method_name, kwargs)
         self._trigger(
             'service.call_method.before', service=self, method=method_name,
             attachment_map=attachment_map, **kwargs)
         try:
-            if attachment_map['files']:
-                response = self._post_mp(
-                    self.url, data, attachment_map['files'])
-            else:
-                response = self._post(self.url, data)
-            for processor in self._client.processors:
-                try:
-                    response = processor(
-                        response, service=self, client=self._client,
-                        method_name=method_name, **kwargs)
-                except Exception:
-                    pass
-            response.raise_for_status()
-            if raise_for_fault:
-                response.raise_for_fault()
+            response = self._send_call(
+                method_name, data, attachment_map, post_options)
+            response = self._process_response(
+                response, method_name, raise_for_fault, **kwargs)
         except excs.JsonWspFault as error:
             log.exception(error)
             raise
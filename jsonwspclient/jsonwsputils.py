@@ -6,11 +6,17 @@ Jsonwsputils :mod:`jsonwspclient.jsonwsputils`
 
 """
 
+import functools
 import io
+import itertools
 import logging
 import os
+import queue
 import re
+import threading
+import time
 import types
+from collections.abc import Iterator
 
 
 def make_method(funct, instance, _cls):
@@ -18,6 +24,31 @@ def make_method(funct, instance, _cls):
     return types.MethodType(funct, instance)
 
 
+def set_methods(obj, methods):
+    """Set the services methods as attributes of obj.
+
+    So they are found by the normal attribute lookup. Class attributes and
+    the attributes set by others (not by a previous call) win, as they did
+    with ``__getattr__``.
+
+    Args:
+        obj (object): the client.
+        methods (dict): methods by name.
+    """
+    previous = obj.__dict__.get('_method_attrs', {})
+    current = {}
+    for name, method in methods.items():
+        if hasattr(type(obj), name) or name.startswith('_'):
+            continue
+        if name in obj.__dict__ and obj.__dict__[name] is not previous.get(name):
+            continue
+        obj.__dict__[name] = current[name] = method
+    for name, method in previous.items():
+        if name not in current and obj.__dict__.get(name) is method:
+            del obj.__dict__[name]
+    obj.__dict__['_method_attrs'] = current
+
+
 has_attachments = re.compile(r'(?i)^cid:(.+)$').match
 _get_multipart = re.compile(r'(?i)multipart/(?P<multipart>[^; ]+)').search
 _get_boundary = re.compile(r'(?i)boundary=(?P<boundary>[^; ]+)').search
@@ -35,6 +66,30 @@ def get_fileitem(path, data='data', name='name', mode='rb'):
     }
 
 
+def limit_timeout(timeout, deadline):
+    """Return the timeout limited by the time left before the deadline.
+
+    Args:
+        timeout (float, tuple): timeout or (connect, read) timeouts.
+        deadline (float): deadline as :func:`time.monotonic` value.
+
+    Returns:
+        float, tuple: the limited timeout (None or not positive values
+            mean the deadline has been exceeded).
+    """
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return None
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if item is None else min(item, remaining)
+                     for item in timeout)
+    return min(timeout, remaining)
+
+
 def get_multipart(headers):
     """return multipart."""
     multipart = _get_multipart(headers.get('Content-type', ''))
@@ -83,9 +138,39 @@ def check_attachment(items):
     return res
 
 
+def is_buffer(val):
+    """Return True if val supports the buffer protocol (bytes, bytearray,
+    memoryview, mmap, array, ...)."""
+    if isinstance(val, (str, int, float, type(None))):
+        return False
+    try:
+        memoryview(val).release()
+    except TypeError:
+        return False
+    return True
+
+
+def is_stream(val):
+    """Return True if val can be sent as attachment (file-like object or
+    iterator of bytes chunks, like a generator)."""
+    return hasattr(val, 'read') or (
+        isinstance(val, Iterator) and not isinstance(val, (str, bytes)))
+
+
 def fix_attachment(val, attachment_map):
     """Fix attachment."""
-    if hasattr(val, 'read'):
+    if isinstance(val, str):
+        if val[:1] == '@' and os.path.isfile(val[1:]):
+            cid = os.path.normpath(val[1:])
+            if cid not in attachment_map['files']:
+                attachment_map['files'][cid] = open(cid, 'rb')
+                attachment_map.setdefault('opened', []).append(
+                    attachment_map['files'][cid])
+            return 'cid:%s' % cid
+        return None
+    if isinstance(val, (int, float, type(None))):
+        return None
+    if is_buffer(val) or is_stream(val):
         while True:
             cid = 'file{}'.format(attachment_map['cid_seq'])
             attachment_map['cid_seq'] += 1
@@ -93,13 +178,13 @@ def fix_attachment(val, attachment_map):
                 break
         attachment_map['files'][cid] = val
         return 'cid:%s' % cid
+    return None
 
-    if (isinstance(val, str) and val and
-            val[0] == '@' and os.path.isfile(val[1:])):
-        cid = os.path.normpath(val[1:])
-        if cid not in attachment_map:
-            attachment_map['files'][cid] = open(cid, 'rb')
-            return 'cid:%s' % cid
+
+def close_opened(attachment_map):
+    """Close the files opened for the ``'@path'`` attachments."""
+    for fobj in attachment_map.get('opened', ()):
+        fobj.close()
 
 
 def walk_args_dict(kwargs, attachment_map):
@@ -123,36 +208,438 @@ def walk_args_dict(kwargs, attachment_map):
                 kwargs[key] = attachment_ref
 
 
+_versions = itertools.count(1)
+
+
+class ParamsMapping(dict):
+    """Params mapping which gets a new :attr:`version` on every change, so
+    the services know when to rebuild their call plans."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = next(_versions)
+        """(int): version, unique across all the mappings."""
+
+    def _changed(self):
+        self.version = next(_versions)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+
 class Observer:
-    """Observer for events."""
+    """Observer for events.
+
+    The events list is copied (so class level events are not shared
+    between instances) and replaced on every change, so :meth:`trigger`
+    can safely run in other threads.
+
+    The listeners of every event name are resolved once and cached, the
+    cache is dropped on every change.
+    """
+
+    def __init__(self, events, dispatcher=None):
+        self._state = (list(events), {})
+        self._lock = threading.Lock()
+        self.dispatcher = dispatcher
+        """(EventDispatcher): background delivery of some events."""
 
-    def __init__(self, events):
-        self._events = events
+    @property
+    def events(self):
+        """([(str, function)]): registered events."""
+        return self._state[0]
 
     def add(self, name, funct):
         """add event."""
-        if not (name, funct, ) in self._events:
-            self._events.append((name, funct,))
+        with self._lock:
+            if not (name, funct, ) in self._state[0]:
+                self._state = (self._state[0] + [(name, funct,)], {})
 
     def remove(self, name, funct):
         """remove event."""
-        if (name, funct, ) in self._events:
-            self._events.remove((name, funct,))
+        with self._lock:
+            if (name, funct, ) in self._state[0]:
+                events = list(self._state[0])
+                events.remove((name, funct,))
+                self._state = (events, {})
+
+    def listeners(self, event):
+        """Return the functions listening for event."""
+        events, cache = self._state
+        try:
+            return cache[event]
+        except KeyError:
+            # a stale cache is dropped with its state, so no lock needed.
+            functs = tuple(
+                funct for name, funct in events
+                if event.startswith(name) or name == '*')
+            if functs and self.dispatcher is not None and (
+                    self.dispatcher.handles(event)):
+                functs = (functools.partial(self.dispatcher.put, functs),)
+            cache[event] = functs
+            return functs
+
+    def listening(self, event):
+        """Return True if someone listens for event."""
+        return bool(self.listeners(event))
 
     def trigger(self, event, *args, **kwargs):
         """Trigger."""
         if not isinstance(event, str):
             args = (event, ) + args
             event = event.__class__.__name__.lower()
-        for name, funct in self._events:
-            if event.startswith(name) or name == '*':
+        for funct in self.listeners(event):
+            funct(event, *args, **kwargs)
+
+
+class EventDispatcher:
+    """Deliver events from a background thread through a bounded queue.
+
+    Events whose name starts with one of ``patterns`` are queued instead
+    of being handled in the triggering thread, in order. When the queue is
+    full the ``overflow`` policy applies:
+
+    - ``'block'``: wait for a free slot.
+    - ``'drop'``: drop the event.
+    - ``'sample'``: wait only for one event out of ``sample`` and drop the
+      others.
+
+    Args:
+        patterns ([str]): event names (or their first part, ``'*'`` for all).
+        size (int, optional): queue size (default 1024).
+        overflow (str, optional): ``'block'``, ``'drop'`` or ``'sample'``
+            (default ``'block'``).
+        sample (int, optional): one event out of these many is delivered
+            when the queue is full and overflow is ``'sample'`` (default 10).
+
+    Attributes:
+
+        delivered (int): events delivered.
+        dropped (int): events dropped because the queue was full.
+    """
+
+    OVERFLOWS = ('block', 'drop', 'sample')
+
+    def __init__(self, patterns, size=1024, overflow='block', sample=10):
+        if overflow not in self.OVERFLOWS:
+            raise ValueError("Unknown overflow policy {}".format(overflow))
+        self.patterns = tuple(patterns)
+        self.overflow = overflow
+        self.sample = max(1, sample)
+        self.delivered = 0
+        self.dropped = 0
+        self._full = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(size)
+        self._thread = None
+        self._closed = False
+
+    def handles(self, event):
+        """Return True if event is delivered in background."""
+        return any(event.startswith(pattern) or pattern == '*'
+                   for pattern in self.patterns)
+
+    def put(self, functs, event, *args, **kwargs):
+        """Queue the event for the functions (or deliver it if closed)."""
+        if self._closed:
+            self._deliver(functs, event, args, kwargs)
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None and not self._closed:
+                    self._thread = threading.Thread(
+                        target=self._run, name='jsonwsp-events', daemon=True)
+                    self._thread.start()
+        item = (functs, event, args, kwargs)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow != 'block':
+                with self._lock:
+                    self._full += 1
+                    if self.overflow == 'drop' or (
+                            self._full % self.sample != 1 % self.sample):
+                        self.dropped += 1
+                        return
+            if not self._wait_put(item):
+                # closed while waiting.
+                self._deliver(*item)
+                return
+        thread = self._thread
+        if self._closed and (thread is None or not thread.is_alive()):
+            # closed meanwhile, nobody else will deliver it.
+            self._drain()
+
+    def _wait_put(self, item):
+        """Wait for a free slot, return False if closed meanwhile."""
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _drain(self):
+        """Deliver the events left in the queue."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._deliver(*item)
+            self._queue.task_done()
+
+    def _deliver(self, functs, event, args, kwargs):
+        """Deliver the event to the functions."""
+        try:
+            for funct in functs:
                 funct(event, *args, **kwargs)
+        except Exception:
+            log.exception('Error handling event %s', event)
+        finally:
+            self.delivered += 1
+
+    def _run(self):
+        """Deliver the queued events until the stop sentinel."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._deliver(*item)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until all the queued events are delivered."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Deliver the queued events and stop the thread, the events
+        triggered later are delivered synchronously."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+        # events queued while closing.
+        self._drain()
+
+    def stats(self):
+        """Return delivered, dropped and queued events."""
+        return dict(delivered=self.delivered, dropped=self.dropped,
+                    queued=self._queue.qsize())
+
+
+def _always(_event):
+    """Always listening."""
+    return True
+
+
+def listening(callback):
+    """Return a function telling if callback handles an event.
+
+    Call sites use it to skip building the events of the hot paths when
+    the :class:`Observer` of callback has no listeners for them, any other
+    callback is always listening.
+    """
+    observer = getattr(callback, '__self__', None)
+    if isinstance(observer, Observer):
+        return observer.listening
+    return _always
+
+
+class SingleFlight:
+    """Share the result of a call between identical concurrent calls.
+
+    The first caller for a key runs the function, the others wait for its
+    result (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, funct, timeout=None):
+        """Run funct once for all the concurrent callers with the same key.
+
+        Args:
+            key (str): call key.
+            funct (function): function to call.
+            timeout (float, optional): max seconds to wait for a shared call.
+
+        Returns:
+            tuple: the function result and True if it was shared by another call.
+
+        Raises:
+            TimeoutError: if the shared call is not done within timeout.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = dict(
+                    event=threading.Event(), result=None, error=None)
+        if not leader:
+            if not call['event'].wait(timeout):
+                raise TimeoutError("Shared call not done in time")
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+        try:
+            call['result'] = funct()
+        except Exception as error:
+            call['error'] = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+        return call['result'], False
+
+
+class Progress:
+    """Throttling policy of the per chunk progress events.
+
+    A chunk event is delivered only when at least ``step`` bytes,
+    ``interval`` seconds or ``percent`` of the length have passed since the
+    last delivered one (with no limit all of them are delivered). The start
+    and end events are always delivered.
+
+    Args:
+        step (int, optional): bytes between two events.
+        interval (float, optional): seconds between two events.
+        percent (float, optional): percent of the length between two events.
+        length (int, optional): transfer length (0 if unknown).
+    """
+
+    def __init__(self, step=None, interval=None, percent=None, length=0):
+        self.step = step
+        """(int): bytes between two events."""
+        self.interval = interval
+        """(float): seconds between two events."""
+        self.percent = percent
+        """(float): percent of the length between two events."""
+        self.length = length or 0
+        """(int): transfer length (0 if unknown)."""
+        self.start = time.monotonic()
+        """(float): :func:`time.monotonic` time of the transfer start."""
+        self._throttled = bool(step or interval or (percent and self.length))
+        self._last_value = 0
+        self._last_time = self.start
+
+    def meter(self, length=0):
+        """Return a new Progress with the same policy for a transfer.
+
+        Args:
+            length (int, optional): transfer length (0 if unknown).
+
+        Returns:
+            Progress: the progress of the transfer.
+        """
+        return Progress(self.step, self.interval, self.percent, length)
+
+    def due(self, value):
+        """Return True if the event for value must be delivered."""
+        if self._throttled:
+            delta = value - self._last_value
+            if not ((self.step and delta >= self.step) or
+                    (self.percent and self.length and
+                     delta * 100.0 >= self.percent * self.length) or
+                    (self.interval and
+                     time.monotonic() - self._last_time >= self.interval)):
+                return False
+            self._last_value = value
+            self._last_time = time.monotonic()
+        return True
+
+    def stats(self, value):
+        """Return throughput (bytes/s) and ETA (seconds, None if unknown)."""
+        elapsed = time.monotonic() - self.start
+        throughput = value / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.length and throughput:
+            eta = max(self.length - value, 0) / throughput
+        return dict(throughput=throughput, eta=eta)
+
+
+def get_progress(progress):
+    """Return a Progress from a Progress instance or a dict of its args."""
+    if progress is None or isinstance(progress, Progress):
+        return progress
+    return Progress(**progress)
+
+
+class CountingReader:
+    """File-like object counting the bytes read from another one.
+
+    Args:
+        fobj (file): file-like object to read.
+    """
+
+    def __init__(self, fobj):
+        self._file = fobj
+        self.count = 0
+        """(int): bytes read."""
+
+    def read(self, *args):
+        """read."""
+        data = self._file.read(*args)
+        self.count += len(data or b'')
+        return data
+
+    def close(self):
+        """Close the file-like object (if it can be closed)."""
+        close = getattr(self._file, 'close', None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
 
 
 class FileWithCallBack:
     """FileWithCallBack."""
 
-    def __init__(self, path, callback, mode='rb', size=0):
+    def __init__(self, path, callback, mode='rb', size=0, progress=None):
         self._read_bytes = 0
         self._write_bytes = 0
         if hasattr(path, 'read'):
@@ -166,6 +653,8 @@ class FileWithCallBack:
         except Exception:
             self._length = size
         self._callback = callback
+        self._listening = listening(callback)
+        self._progress = (progress or Progress()).meter(self._length)
         self._callback(
             'file.init', fobj=self._file, value=0, length=self._length)
 
@@ -185,7 +674,8 @@ class FileWithCallBack:
         return getattr(self._file, name)
 
     def __len__(self):
-        return self._length
+        # 0 for unknown length, so the content is sent chunked.
+        return self._length or 0
 
     def __enter__(self):
         return self
@@ -197,8 +687,11 @@ class FileWithCallBack:
         """write."""
         self._file.write(data)
         self._write_bytes += len(data)
-        self._callback('file.write', fobj=self._file,
-                       value=self._write_bytes, length=self._length)
+        if (self._listening('file.write') and
+                self._progress.due(self._write_bytes)):
+            self._callback('file.write', fobj=self._file,
+                           value=self._write_bytes, length=self._length,
+                           **self._progress.stats(self._write_bytes))
 
     def read(self, size):
         """read."""
@@ -207,9 +700,13 @@ class FileWithCallBack:
                            value=self._read_bytes, length=self._length)
         data = self._file.read(size)
         self._read_bytes += len(data or "")
-        self._callback('file.read', fobj=self._file,
-                       value=self._read_bytes, length=self._length)
+        if (self._listening('file.read') and
+                self._progress.due(self._read_bytes)):
+            self._callback('file.read', fobj=self._file,
+                           value=self._read_bytes, length=self._length,
+                           **self._progress.stats(self._read_bytes))
         if len(data or "") == 0:
             self._callback('file.end', fobj=self._file,
-                           value=self._read_bytes, length=self._length)
+                           value=self._read_bytes, length=self._length,
+                           **self._progress.stats(self._read_bytes))
         return data
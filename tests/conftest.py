@@ -20,6 +20,8 @@ application = LadonWSGIApplication(['transfertest'], [PATH])
 
 @pytest.fixture()
 def cleandir():
+    for folder in ('upload', 'download'):
+        os.makedirs(join(PATH, folder), exist_ok=True)
     for path in glob.iglob(join(PATH, 'upload/*')):
         os.remove(path)
     for path in glob.iglob(join(PATH, 'download/*')):
@@ -6,13 +6,26 @@ Test_jsonwspclient :mod:`tests.test_jsonwspclient`
 
 """
 from __future__ import print_function
+import os
 from os.path import abspath, dirname, join
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import mmap
 import tempfile
+import threading
+import time
 import filecmp
+import hashlib
 import pytest
-from jsonwspclient import JsonWspClient
-from jsonwspclient.jsonwsputils import get_fileitem
-from jsonwspclient.jsonwspexceptions import JsonWspFault, ParamsError
+import requests
+from jsonwspclient import AsyncJsonWspClient, DescriptionCache, JsonWspClient
+from jsonwspclient.jsonwspmultipart import (
+    JsonWspAttachment, MultiPartReader, MultiPartWriter)
+from jsonwspclient.jsonwsputils import (
+    EventDispatcher, FileWithCallBack, Observer, get_fileitem)
+from jsonwspclient.jsonwspexceptions import (
+    DeadlineExceeded, JsonWspFault, ParamsError)
 PATH = dirname(abspath(__file__))
 RES_PATH = join(PATH, 'resource')
 DOWN_PATH = join(PATH, 'download')
@@ -100,6 +113,24 @@ def test_params_mapping_two(testserver):
     assert cli.check_token()
 
 
+def test_params_mapping_changes(testserver):
+    """call plans follow the params_mapping changes"""
+    cli = JsonWspClient(testserver.url, services=['Authenticate'])
+    token = cli.get_user().result['token']
+    with pytest.raises(ParamsError):
+        cli.check_token()
+    cli.token = token
+    cli.params_mapping['token'] = 'token'
+    assert cli.check_token()
+    del cli.params_mapping['token']
+    with pytest.raises(ParamsError):
+        cli.check_token()
+    cli.params_mapping |= {'token': 'token'}
+    assert cli.check_token()
+    cli.params_mapping = {'token': lambda **kwargs: token}
+    assert cli.check_token()
+
+
 def test_params_mapping_error_one(testserver, cleandir):
     """params_mapping"""
     cli = JsonWspClient(testserver.url, services=['TransferService'])
@@ -216,3 +247,704 @@ def test_all(testserver):
             except JsonWspFault as error:
                 print("error", error)
     assert filecmp.cmpfiles(RES_PATH, DOWN_PATH, FILENAME)
+
+
+def test_async_client(testserver):
+    """test async client"""
+    pytest.importorskip('aiohttp')
+
+    async def run():
+        """run"""
+        async with AsyncJsonWspClient(
+                testserver.url, ['ClacService', 'TransferService']) as cli:
+            res = await cli.sum(numbers=[1, 2, 3])
+            assert res.result == 6
+            assert cli.service('TransferService') is not None
+            res = await cli.multi_download(
+                names=['test-20-1.txt', 'test-20-2.txt'])
+            attachs = [attach async for attach in res]
+            assert [attach.index for attach in attachs] == [0, 1]
+            res = await cli.multi_download(
+                names=['test-20-1.txt', 'test-20-2.txt'])
+            wanted = res.result[1]['data']
+            attachs = await res.read_all(accept={wanted})
+            assert ['cid:' + att_id for att_id in attachs] == [wanted]
+    asyncio.run(run())
+
+
+def test_description_cache_default_path(tmpdir, monkeypatch):
+    """default cache folder is private to the user"""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    cache = DescriptionCache()
+    assert cache.path == os.path.join(str(tmpdir), 'jsonwspclient')
+    assert os.stat(cache.path).st_mode & 0o077 == 0
+
+
+def test_description_cache(testserver, tmpdir):
+    """test description cache"""
+    cache = DescriptionCache(str(tmpdir), ttl=60)
+    JsonWspClient(testserver.url, ['ClacService'], description_cache=cache)
+    events = []
+    cli = JsonWspClient(
+        testserver.url, ['ClacService'], description_cache=cache,
+        events=[('client.post', lambda name, **kw: events.append(name)),
+                ('service.description_loaded',
+                 lambda name, **kw: events.append(name))])
+    assert events == ['service.description_loaded']
+    assert cli.sum(numbers=[1, 2, 3]).result == 6
+
+
+def test_lazy_loading(testserver, tmpdir):
+    """test lazy loading"""
+    loaded = []
+    events = [('service.description_loaded',
+               lambda name, service: loaded.append(service.name))]
+    cli = JsonWspClient(
+        testserver.url, ['Authenticate', 'TransferService'], lazy=True,
+        events=events)
+    assert not hasattr(cli, 'missing') and not hasattr(cli, 'get_user')
+    assert loaded == []
+    assert cli.transferservice.name == 'TransferService'
+    assert loaded == ['TransferService']
+    # get_info is in both services but the first one always wins.
+    assert cli.get_info().result['name'] == 'Authenticate'
+    assert loaded == ['TransferService', 'Authenticate']
+    assert 'download' in dir(cli.preload())
+    # the methods of the cached descriptions are known before loading.
+    cache = DescriptionCache(str(tmpdir))
+    JsonWspClient(testserver.url, ['Authenticate'], description_cache=cache)
+    del loaded[:]
+    cli = JsonWspClient(
+        testserver.url, ['Authenticate', 'TransferService'], lazy=True,
+        description_cache=cache, events=events)
+    assert cli.get_user().result['token']
+    assert not hasattr(cli, 'download')
+    assert cli.method('download') is not None
+    assert loaded == ['Authenticate', 'TransferService']
+
+
+def test_concurrent_loading(testserver):
+    """test concurrent loading"""
+    timings = {}
+
+    def service_loaded(name, client, service, elapsed):
+        """service loaded"""
+        timings[service.name] = elapsed
+
+    services = ['Authenticate', 'TransferService', 'ClacService', 'FaultService']
+    cli = JsonWspClient(
+        testserver.url, services, load_workers=4,
+        events=[('client.service_loaded', service_loaded)])
+    assert sorted(timings) == sorted(services)
+    assert cli.get_info().result['name'] == 'Authenticate'
+    assert cli.sum(numbers=[1, 2]).result == 3
+
+
+def test_call_many(testserver):
+    """test call_many"""
+    cli = JsonWspClient(testserver.url, ['ClacService', 'FaultService'])
+    calls = [('sum', {'numbers': [idx, 1]}) for idx in range(20)]
+    calls.append(('raise_fault', {'ftype': 'server', 'raise_for_fault': True}))
+    calls.append(('sum', {}))
+    results = cli.call_many(calls, max_workers=4)
+    assert [res.result for res in results[:20]] == list(range(1, 21))
+    assert isinstance(results[20], JsonWspFault)
+    assert isinstance(results[21], ParamsError)
+    unordered = dict(cli.call_many(calls[:20], ordered=False))
+    assert sorted(unordered) == list(range(20))
+
+
+def test_thread_safe(testserver):
+    """test thread safe mode"""
+    cli = JsonWspClient(
+        testserver.url, ['ClacService'], thread_safe=True, threads=4)
+
+    def work(number):
+        """call and check the thread last response"""
+        res = cli.sum(numbers=[number, 1])
+        return res.result == number + 1 and cli.last_response is res
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(work, range(40)))
+
+
+def test_events_not_shared(testserver):
+    """test class events are not shared between instances"""
+    class MyClient(JsonWspClient):
+        """My Client"""
+        events = []
+    cli = MyClient(testserver.url, ['ClacService'])
+    cli.add_event('client.post', print)
+    assert MyClient.events == []
+
+
+def test_pool_stats(testserver):
+    """test connections pool stats"""
+    cli = JsonWspClient(testserver.url, ['ClacService'], pool_maxsize=2)
+    for idx in range(3):
+        assert cli.sum(numbers=[idx]).result == idx
+    stats = cli.pool_stats()
+    assert stats['active'] == 0
+    assert stats['idle'] == 1
+    assert stats['created'] == 1
+    cli = JsonWspClient(
+        testserver.url, ['ClacService'], pool_idle_timeout=0)
+    cli.sum(numbers=[1])
+    assert cli.pool_stats()['discarded'] >= 1
+    cli = JsonWspClient(
+        testserver.url, ['ClacService'], pool_idle_timeout=0.2)
+    cli.sum(numbers=[1])
+    assert cli.pool_stats()['idle'] == 1
+    time.sleep(0.3)
+    stats = cli.pool_stats()
+    assert (stats['idle'], stats['discarded']) == (0, 1)
+    cli.sum(numbers=[1])
+    stats = cli.pool_stats()
+    assert (stats['active'], stats['idle'], stats['created']) == (0, 1, 2)
+
+
+def test_timeouts(testserver, cleandir):
+    """test timeouts and deadlines"""
+    cli = JsonWspClient(
+        testserver.url, ['ClacService', 'TransferService'], timeout=10,
+        method_timeouts={'sum': (5, 5)})
+    assert cli.sum(numbers=[1, 2], timeout=3).result == 3
+    assert cli.sum(numbers=[1, 2], deadline=10).result == 3
+    with pytest.raises(DeadlineExceeded):
+        cli.sum(numbers=[1, 2], deadline=0)
+    res = cli.download(name=FILENAME, deadline=10)
+    assert len(res.read_all()) == 1
+
+
+def test_response_cache(testserver):
+    """test response cache"""
+    events = []
+    cli = JsonWspClient(
+        testserver.url, ['Authenticate'], cache_methods=['get_info'],
+        events=[('service.cache', lambda name, **kw: events.append(name))])
+    res = cli.get_info()
+    res.result['name'] = 'changed'
+    assert cli.get_info().result['name'] == 'Authenticate'
+    assert cli.get_info().result['name'] == 'Authenticate'
+    assert events == [
+        'service.cache.miss', 'service.cache.hit', 'service.cache.hit']
+    assert cli.response_cache.stats() == dict(hits=2, misses=1, size=1)
+    cli.get_user()
+    assert len(cli.response_cache) == 1
+    assert cli.get_info() is cli.last_response
+
+
+def test_coalesce(testserver):
+    """test coalescing of identical concurrent calls"""
+    posts = []
+
+    def slow_post(name, **kwargs):
+        """slow down the posts so the calls overlap"""
+        posts.append(name)
+        time.sleep(0.2)
+
+    cli = JsonWspClient(
+        testserver.url, ['Authenticate'], coalesce=True, thread_safe=True)
+    cli.add_event('client.post.before', slow_post)
+    barrier = threading.Barrier(8)
+
+    def work(dummy):
+        """call get_info all together"""
+        barrier.wait()
+        res = cli.get_info()
+        assert res is cli.last_response
+        res.result['name'] = 'changed'
+        return res
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(work, range(8)))
+    assert len(posts) < 8
+    assert len(set(id(res.response_dict) for res in results)) == 8
+    assert cli.get_info().result['name'] == 'Authenticate'
+
+
+@pytest.mark.parametrize('engine', ['regex', 'buffer'])
+def test_reader_engines(testserver, engine):
+    """test multipart reader engines"""
+    cli = JsonWspClient(
+        testserver.url, ['TransferService'], reader_engine=engine)
+    res = cli.multi_download(
+        names=['test-20-1.txt', 'bintest-20-1.txt', 'test-20-2.txt'])
+    attachs = list(res)
+    assert [attach.index for attach in attachs] == [0, 1, 2]
+    for item, attach in zip(res.result, attachs):
+        assert item['data'] == 'cid:' + attach.att_id
+        with open(join(RES_PATH, item['name']), 'rb') as fobj:
+            assert attach.open().read() == fobj.read()
+
+
+def test_spooled_attachments(testserver, tmpdir):
+    """test in memory attachments"""
+    names = ['test-20-1.txt', 'bintest-20-1.txt']
+    sizes = [os.path.getsize(join(RES_PATH, name)) for name in names]
+    cli = JsonWspClient(
+        testserver.url, ['TransferService'], spool_size=min(sizes))
+    res = cli.multi_download(names=names)
+    attachs = list(res)
+    assert [attach.in_memory for attach in attachs] == [
+        size <= min(sizes) for size in sizes]
+    for name, attach in zip(names, attachs):
+        with open(join(RES_PATH, name), 'rb') as fobj:
+            data = fobj.read()
+        assert attach.length == len(data)
+        assert attach.open().read() == data
+        attach.save(str(tmpdir), filename=name)
+        with open(join(str(tmpdir), name), 'rb') as fobj:
+            assert fobj.read() == data
+        with open(attach.path, 'rb') as fobj:
+            assert fobj.read() == data
+        assert not attach.in_memory
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_save_all_direct(testserver, tmpdir, direct):
+    """test save_all moving or writing directly the attachments"""
+    names = ['test-20-1.txt', 'bintest-20-1.txt', 'test-20-2.txt']
+    cli = JsonWspClient(testserver.url, ['TransferService'])
+    res = cli.multi_download(names=names)
+    res.save_all(str(tmpdir), direct=direct)
+    for attach in res.read_all().values():
+        # the saved files are not temporary data.
+        attach.remove()
+    assert sorted(os.listdir(str(tmpdir))) == sorted(names)
+    for name in names:
+        assert filecmp.cmp(
+            join(RES_PATH, name), join(str(tmpdir), name), shallow=False)
+
+
+def test_sink(testserver):
+    """test attachments sent to a sink"""
+    names = ['bintest-20-1.txt', 'test-20-1.txt', 'test-20-2.txt']
+
+    class Hasher(object):
+        """hashing sink"""
+
+        def __init__(self, att_id, headers):
+            self.att_id = att_id
+            self.hash = hashlib.md5()
+
+        def write(self, data):
+            """write"""
+            self.hash.update(data)
+
+        def close(self):
+            """close"""
+            return self.hash.hexdigest()
+
+    cli = JsonWspClient(testserver.url, ['TransferService'])
+    res = cli.multi_download(names=names)
+    by_id = res.read_all(sink=Hasher)
+    assert len(by_id) == 3
+    for item in res.result:
+        attach = by_id[item['data'][4:]]
+        with open(join(RES_PATH, item['name']), 'rb') as fobj:
+            data = fobj.read()
+        assert attach.sink.att_id == attach.att_id
+        assert attach.result == hashlib.md5(data).hexdigest()
+        assert attach.path is None
+
+
+@pytest.mark.parametrize('engine', ['regex', 'buffer'])
+def test_first_attachment(testserver, tmpdir, monkeypatch, engine):
+    """sink and filter apply to the attachment in the first chunk too"""
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    created = []
+    init = JsonWspAttachment.__init__
+
+    def counting_init(self, *args, **kwargs):
+        """count the attachments"""
+        created.append(self)
+        init(self, *args, **kwargs)
+    monkeypatch.setattr(JsonWspAttachment, '__init__', counting_init)
+
+    class Collector(object):
+        """collecting sink"""
+
+        def __init__(self, att_id, headers):
+            self.data = []
+
+        def write(self, data):
+            """write"""
+            self.data.append(bytes(data))
+
+        def close(self):
+            """close"""
+            return b''.join(self.data)
+
+    with open(join(RES_PATH, FILENAME), 'rb') as fobj:
+        data = fobj.read()
+    cli = JsonWspClient(
+        testserver.url, ['TransferService'], reader_engine=engine)
+    attachs = list(cli.download(name=FILENAME).read_all(
+        sink=Collector).values())
+    assert [attach.result for attach in attachs] == [data]
+    assert cli.download(name=FILENAME).read_all(accept=set()) == {}
+    del created[:]
+    res = cli.multi_download(names=[FILENAME, 'test-20-1.txt'])
+    wanted = res.result[1]['data']
+    attachs = res.read_all(sink=Collector, accept={wanted})
+    assert ['cid:' + att_id for att_id in attachs] == [wanted]
+    assert [attach.att_id for attach in created] == list(attachs)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_attachment_filter(testserver, tmpdir):
+    """test attachments filter"""
+    names = ['bintest-20-1.txt', 'test-20-1.txt', 'test-20-2.txt']
+    cli = JsonWspClient(testserver.url, ['TransferService'])
+    res = cli.multi_download(names=names)
+    wanted = res.result[2]['data']
+    attachs = list(res.iter_attachments(accept={wanted}))
+    assert ['cid:' + attach.att_id for attach in attachs] == [wanted]
+    res = cli.multi_download(names=names)
+    res.save_all(
+        str(tmpdir),
+        accept=lambda headers: 'cid:' + headers['content-id'] != wanted)
+    assert sorted(os.listdir(str(tmpdir))) == names[:2]
+    res = cli.multi_download(names=names)
+    assert list(res.read_all(accept=set())) == []
+
+
+def test_writer_queue(testserver):
+    """test attachments written by a background thread"""
+    names = ['bintest-20-1.txt', 'test-20-1.txt', 'test-20-2.txt']
+    sizes = []
+
+    def on_end(event_name, **kwargs):
+        """all the data must be on disk when the reader ends"""
+        sizes.append(os.path.getsize(kwargs['attach'].path))
+
+    cli = JsonWspClient(
+        testserver.url, ['TransferService'], writer_queue=4,
+        events=[('multipartreader.end', on_end)])
+    attachs = []
+    for attach in cli.multi_download(names=names):
+        attachs.append(attach)
+    assert [attach.index for attach in attachs] == [0, 1, 2]
+    assert sizes == [os.path.getsize(join(RES_PATH, names[-1]))]
+    for name, attach in zip(names, attachs):
+        assert filecmp.cmp(join(RES_PATH, name), attach.path, shallow=False)
+
+
+def test_writer_queue_stop(testserver):
+    """test the writer thread stops when the response is not read to the end"""
+    import gc
+    names = ['test-20-1.txt', 'bintest-20-1.txt', 'test-20-2.txt']
+
+    def writers():
+        """alive writer threads"""
+        return [thread for thread in threading.enumerate()
+                if thread.name == 'jsonwspclient-writer']
+
+    def broken(event_name, value=0, **kwargs):
+        """break the download"""
+        if value > 100000:
+            raise IOError('broken')
+
+    cli = JsonWspClient(testserver.url, ['TransferService'], writer_queue=4)
+    for _ in range(3):
+        res = cli.multi_download(names=names)
+        next(res)
+        del res
+    with cli.multi_download(names=names) as res:
+        next(res)
+    gc.collect()
+    cli.add_event('file.read', broken)
+    with pytest.raises(IOError):
+        cli.multi_download(names=names).read_all()
+    assert writers() == []
+
+
+def test_upload_stream():
+    """test multipart writer with not seekable attachments"""
+    with open(join(RES_PATH, FILENAME), 'rb') as fobj:
+        data = fobj.read()
+    events = []
+
+    def chunks():
+        """generate the file data"""
+        for pos in range(0, len(data), 100000):
+            yield data[pos:pos + 100000]
+
+    def callback(name, **kwargs):
+        """record the part events"""
+        events.append((name, kwargs['value'], kwargs['length']))
+
+    writer = MultiPartWriter(
+        {'incoming': 'cid:file1'}, {'file1': chunks()}, callback=callback)
+    assert writer.length is None
+    body = b''.join(iter(writer.read, None))
+    assert events[0] == ('multipartwriter.part.start', 0, None)
+    assert events[-1] == ('multipartwriter.part.end', len(data), None)
+    stream = FileWithCallBack(writer, callback, size=writer.length)
+    request = requests.Request('POST', 'http://localhost/', data=stream)
+    assert request.prepare().headers['Transfer-Encoding'] == 'chunked'
+    headers = requests.structures.CaseInsensitiveDict(
+        {'Content-Type': writer.headers['Content-type'].decode()})
+    reader = MultiPartReader(
+        headers, io.BytesIO(body), size=len(body)).read_all()
+    assert reader.info['incoming'] == 'cid:file1'
+    assert reader.by_id['file1'].open().read() == data
+
+
+def test_upload_buffer(testserver, cleandir):
+    """test upload of buffers"""
+    with open(join(RES_PATH, FILENAME), 'rb') as fobj:
+        data = bytearray(fobj.read())
+    writer = MultiPartWriter({'incoming': 'cid:file1'}, {'file1': data})
+    chunks = [chunk for chunk in iter(writer.read, None)
+              if isinstance(chunk, memoryview)]
+    assert all(chunk.obj is data for chunk in chunks)
+    assert sum(len(chunk) for chunk in chunks) == len(data)
+    assert len(writer) == len(b''.join(iter(MultiPartWriter(
+        {'incoming': 'cid:file1'}, {'file1': data}).read, None)))
+    cli = JsonWspClient(testserver.url, services=['TransferService'])
+    assert cli.upload(incoming={'name': FILENAME, 'data': data}).result == 1
+    with open(join(UP_PATH, FILENAME), 'rb') as fobj:
+        assert fobj.read() == data
+    # the uploaded buffers are released.
+    del chunks, writer
+    data += b'x'
+    with open(join(RES_PATH, FILENAME), 'rb') as fobj:
+        mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    assert cli.upload(incoming={'name': FILENAME, 'data': mapped}).result == 1
+    mapped.close()
+
+
+def test_attachment_mmap(testserver):
+    """test memory mapped attachments"""
+    names = ['bintest-20-1.txt', 'test-20-1.txt']
+    cli = JsonWspClient(testserver.url, ['TransferService'], spool_size=10)
+    for name, attach in zip(names, cli.multi_download(names=names)):
+        with open(join(RES_PATH, name), 'rb') as fobj:
+            data = fobj.read()
+        view = attach.mmap()
+        assert view[:] == data
+        with pytest.raises(TypeError):
+            view[0] = 0
+        if not attach.in_memory:
+            attach.remove()
+            assert os.path.exists(attach.path)
+            view.close()
+            attach.remove()
+            assert not os.path.exists(attach.path)
+
+
+def test_upload_many(testserver, cleandir):
+    """test concurrent uploads"""
+    names = os.listdir(RES_PATH)
+    files = [open(join(RES_PATH, name), 'rb') for name in names[1:]]
+    uploads = [('upload', {'incoming': {
+        'name': names[0], 'data': '@' + join(RES_PATH, names[0])}})]
+    uploads += [('upload', {'incoming': {'name': name, 'data': fobj}})
+                for name, fobj in zip(names[1:], files)]
+    uploads.append(('upload', {}))
+    cli = JsonWspClient(testserver.url, services=['TransferService'])
+    stats = cli.upload_many(iter(uploads), max_workers=2)
+    sizes = [os.path.getsize(join(RES_PATH, name)) for name in names]
+    assert [res['response'].result for res in stats['results'][:-1]] == [
+        1] * len(names)
+    assert [res['bytes'] for res in stats['results'][:-1]] == sizes
+    assert isinstance(stats['results'][-1]['response'], Exception)
+    assert stats['bytes'] == sum(sizes)
+    assert stats['throughput'] > 0
+    assert all(fobj.closed for fobj in files)
+    for name in names:
+        assert filecmp.cmp(
+            join(RES_PATH, name), join(UP_PATH, name), shallow=False)
+
+
+def test_upload_many_concurrent(testserver, cleandir):
+    """test upload_many along with other uploads of the same client"""
+    path = join(RES_PATH, FILENAME)
+    size = os.path.getsize(path)
+    with open(join(RES_PATH, 'test-20-1.txt'), 'rb') as fobj:
+        small = fobj.read()
+    uploads = [('upload', {'incoming': {'name': FILENAME, 'data': '@' + path}})
+               for _ in range(6)]
+    uploads.append(('upload', {'incoming': {'name': 'x', 'data': small}}))
+    for options in ({'thread_safe': True},
+                    {'background_events': ['multipartwriter']}):
+        cli = JsonWspClient(
+            testserver.url, services=['TransferService'],
+            events=[('multipartwriter.', lambda name, **kw: None)], **options)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            others = [executor.submit(
+                cli.upload, incoming={'name': 'test-20-1.txt', 'data': small})
+                for _ in range(4)]
+            many = [executor.submit(cli.upload_many, uploads, 2)
+                    for _ in range(2)]
+            assert all(other.result().result == 1 for other in others)
+            for stats in (future.result() for future in many):
+                assert [res['response'].result
+                        for res in stats['results']] == [1] * 7
+                assert stats['bytes'] == size * 6 + len(small)
+        cli.close()
+
+
+def test_observer_listeners():
+    """test cached events dispatch"""
+    calls = []
+
+    def first(event_name, **kwargs):
+        calls.append(('first', event_name))
+
+    def second(event_name, **kwargs):
+        calls.append(('second', event_name))
+
+    observer = Observer([('file.', first)])
+    assert not observer.listening('multipartreader.read')
+    observer.trigger('file.read', value=1)
+    observer.add('file.read', second)
+    assert observer.listeners('file.read') == (first, second)
+    observer.trigger('file.read', value=2)
+    observer.remove('file.', first)
+    observer.trigger('file.read', value=3)
+    assert calls == [
+        ('first', 'file.read'), ('first', 'file.read'),
+        ('second', 'file.read'), ('second', 'file.read')]
+    stream = FileWithCallBack(io.BytesIO(b'data'), observer.trigger)
+    observer.remove('file.read', second)
+    del calls[:]
+    assert stream.read(2) == b'da'
+    assert calls == []
+
+
+def test_progress(testserver, cleandir):
+    """test throttled progress events"""
+    events = []
+
+    def progress(event_name, **kwargs):
+        events.append((event_name, kwargs))
+
+    cli = JsonWspClient(
+        testserver.url, ['TransferService'], progress={'percent': 25},
+        events=[('file.', progress), ('multipartreader.', progress),
+                ('multipartwriter.', progress)])
+    with open(join(RES_PATH, FILENAME), 'rb') as fobj:
+        data = fobj.read()
+    cli.upload(incoming={'name': FILENAME, 'data': data})
+    names = [name for name, _ in events]
+    assert names.count('multipartwriter.part.start') == 1
+    assert names.count('multipartwriter.part.end') == 1
+    assert 0 < names.count('multipartwriter.part.write') <= 4
+    assert 0 < names.count('file.read') <= 5
+    end = [kwargs for name, kwargs in events
+           if name == 'multipartwriter.part.end'][0]
+    assert end['value'] == len(data)
+    assert end['throughput'] >= 0 and end['eta'] == 0
+    del events[:]
+    cli.download(name=FILENAME).read_all(1024)
+    names = [name for name, _ in events]
+    assert names.count('multipartreader.end') == 1
+    assert 0 < names.count('multipartreader.read') <= 5
+    end = [kwargs for name, kwargs in events
+           if name == 'multipartreader.end'][0]
+    assert end['attach_value'] == len(data)
+    assert 'eta' in end and 'throughput' in end
+
+
+def test_background_events(testserver):
+    """test events delivered by a background thread"""
+    delivered = []
+
+    def audit(event_name, **kwargs):
+        time.sleep(0.01)
+        delivered.append((event_name, threading.current_thread().name))
+
+    cli = JsonWspClient(
+        testserver.url, ['ClacService'], background_events=['client.post.after'],
+        events=[('client.post.', audit)])
+    for idx in range(5):
+        assert cli.sum(numbers=[idx, 1]).result == idx + 1
+    cli.close()
+    names = [name for name, _ in delivered]
+    assert names.count('client.post.after') == names.count(
+        'client.post.before') >= 5
+    assert all(thread == 'jsonwsp-events' for name, thread in delivered
+               if name == 'client.post.after')
+    assert all(thread != 'jsonwsp-events' for name, thread in delivered
+               if name == 'client.post.before')
+    assert 'jsonwsp-events' not in [
+        thread.name for thread in threading.enumerate()]
+    # once closed the events are delivered synchronously.
+    del delivered[:]
+    cli.sum(numbers=[1, 1])
+    assert [thread for name, thread in delivered] == [
+        threading.current_thread().name] * 2
+    for overflow, expected in (('drop', 8), ('sample', 6)):
+        dispatcher = EventDispatcher(['*'], size=1, overflow=overflow, sample=4)
+        observer = Observer([('*', lambda name: time.sleep(0.05))], dispatcher)
+        observer.trigger('first')
+        while dispatcher.stats()['queued']:
+            time.sleep(0.001)
+        # the worker is busy with the first event, fill the queue.
+        observer.trigger('second')
+        for _ in range(8):
+            observer.trigger('other')
+        dispatcher.flush()
+        assert dispatcher.dropped == expected
+        assert dispatcher.delivered == 10 - expected
+        dispatcher.close()
+    # events put while closing (even waiting for a full queue) or after
+    # closing are delivered.
+    gate = threading.Event()
+    got = []
+
+    def slow(name):
+        gate.wait(5)
+        got.append(name)
+    dispatcher = EventDispatcher(['*'], size=1)
+    dispatcher.put([slow], 'first')
+    while dispatcher.stats()['queued']:
+        time.sleep(0.001)
+    dispatcher.put([slow], 'second')
+    late = threading.Thread(target=dispatcher.put, args=([slow], 'late'))
+    late.start()
+    closer = threading.Thread(target=dispatcher.close)
+    closer.start()
+    time.sleep(0.2)
+    gate.set()
+    closer.join(5)
+    late.join(5)
+    assert not closer.is_alive() and not late.is_alive()
+    dispatcher.put([got.append], 'after')
+    assert sorted(got) == ['after', 'first', 'late', 'second']
+    with pytest.raises(ValueError):
+        EventDispatcher(['*'], overflow='spill')
+
+
+def test_generated_services(testserver):
+    """test generated service classes"""
+    import inspect
+    from jsonwspclient.jsonwspservice import JsonWspService
+    cli = JsonWspClient(testserver.url, ['ClacService', 'TransferService'])
+    other = JsonWspClient(testserver.url, ['TransferService'])
+    srv = cli.service('TransferService')
+    assert type(srv) is type(other.service('TransferService'))
+    assert isinstance(srv, JsonWspService) and type(srv).__name__ == 'TransferService'
+    assert 'download' in vars(type(srv))
+    assert 'sum' in vars(cli) and cli.sum.__self__ is cli.service('ClacService')
+    params = inspect.signature(type(srv).download).parameters
+    assert params['name'].kind is inspect.Parameter.KEYWORD_ONLY
+    assert repr(params['name'].default) == '<required>'
+    assert 'name (string)' in type(srv).download.__doc__
+    assert cli.sum.mandatory == ['numbers']
+    assert cli.sum(numbers=[1, 2]).result == 3
+    cli.sum = 'mine'
+    cli.preload()
+    assert cli.sum == 'mine'
+    with pytest.raises(ParamsError):
+        cli.method('sum')()
+    # the classes not used anymore are not kept.
+    import gc
+    import weakref
+    from jsonwspclient.jsonwspservice import service_class
+    ref = weakref.ref(service_class(JsonWspService, 'Unused', {}))
+    gc.collect()
+    assert ref() is None